@@ -0,0 +1,150 @@
+import json
+import sqlite3
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Base d'articles persistante, alimentée édition par édition par l'export et
+# les classifieurs. articles_fts est un index plein texte FTS5 sur articleText,
+# synchronisé par triggers ; la colonne data garde l'article JSON complet.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL UNIQUE,
+    doc_id TEXT NOT NULL,
+    source TEXT NOT NULL,
+    date TEXT NOT NULL,
+    page TEXT,
+    reference TEXT,
+    lang TEXT,
+    title TEXT,
+    article_text TEXT NOT NULL,
+    is_legal INTEGER,
+    cat_slug TEXT,
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_articles_reference ON articles (reference);
+CREATE INDEX IF NOT EXISTS idx_articles_source_date ON articles (source, date);
+CREATE INDEX IF NOT EXISTS idx_articles_date ON articles (date);
+CREATE INDEX IF NOT EXISTS idx_articles_is_legal ON articles (is_legal);
+CREATE INDEX IF NOT EXISTS idx_articles_cat_slug ON articles (cat_slug);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS articles_fts USING fts5(
+    article_text, content='articles', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+CREATE TRIGGER IF NOT EXISTS articles_ai AFTER INSERT ON articles BEGIN
+    INSERT INTO articles_fts (rowid, article_text) VALUES (new.id, new.article_text);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_ad AFTER DELETE ON articles BEGIN
+    INSERT INTO articles_fts (articles_fts, rowid, article_text) VALUES ('delete', old.id, old.article_text);
+END;
+CREATE TRIGGER IF NOT EXISTS articles_au AFTER UPDATE OF article_text ON articles BEGIN
+    INSERT INTO articles_fts (articles_fts, rowid, article_text) VALUES ('delete', old.id, old.article_text);
+    INSERT INTO articles_fts (rowid, article_text) VALUES (new.id, new.article_text);
+END;
+"""
+
+
+def _cat_slug(article: dict):
+    cat = article.get("cat")
+    return cat[0].get("slug") if isinstance(cat, list) and cat else None
+
+
+def _is_legal(article: dict):
+    return None if article.get("is_legal") is None else int(bool(article["is_legal"]))
+
+
+class ArticleStore:
+    """Base SQLite des articles exportés, avec recherche plein texte (FTS5)."""
+
+    def __init__(self, db_path):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path), timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        # Nécessaire pour que INSERT OR REPLACE déclenche le trigger de suppression FTS
+        self.conn.execute("PRAGMA recursive_triggers = ON")
+        self.conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def close(self):
+        self.conn.close()
+
+    # === Écriture ===
+
+    def ingest_edition(self, header: dict, articles) -> int:
+        """Remplace les articles d'une édition (doc_type + doc_id) en une seule transaction.
+
+        articles peut être un itérable (ex. lecture NDJSON au fil de l'eau).
+        """
+        source, doc_id = header["doc_type"], header["doc_id"]
+        count = 0
+        with self._transaction():
+            self.conn.execute("DELETE FROM articles WHERE source = ? AND doc_id = ?", (source, doc_id))
+            for article in articles:
+                article = {k: v for k, v in article.items() if k != "record"}
+                self.conn.execute(
+                    """INSERT OR REPLACE INTO articles
+                       (file, doc_id, source, date, page, reference, lang, title, article_text, is_legal, cat_slug, data)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                    (article["file"], doc_id, source, doc_id, article.get("page"), article.get("reference"),
+                     article.get("lang"), article.get("title"), article["articleText"], _is_legal(article),
+                     _cat_slug(article), json.dumps(article, ensure_ascii=False)))
+                count += 1
+        logger.info(f"Article store: {count} articles ingérés pour {source} {doc_id}")
+        return count
+
+    def update_classification(self, articles) -> int:
+        """Met à jour is_legal / cat des articles déjà ingérés (clé : file), en une transaction."""
+        count = 0
+        with self._transaction():
+            for article in articles:
+                article = {k: v for k, v in article.items() if k != "record"}
+                cur = self.conn.execute(
+                    "UPDATE articles SET is_legal = ?, cat_slug = ?, data = ? WHERE file = ?",
+                    (_is_legal(article), _cat_slug(article), json.dumps(article, ensure_ascii=False),
+                     article["file"]))
+                count += cur.rowcount
+        return count
+
+    # === Lecture ===
+
+    def search(self, query: str = None, source: str = None, date_from: str = None, date_to: str = None,
+               is_legal: bool = None, category: str = None, reference: str = None, limit: int = 50) -> list:
+        """Recherche d'articles ; query suit la syntaxe FTS5 (ex. 'شركة AND تونس', '"fonds de commerce"').
+
+        Dates au format YYYY-MM-DD. Résultats triés par pertinence (avec query) ou par date décroissante.
+        """
+        clauses, params = [], []
+        for column, op, value in (("a.source", "=", source), ("a.date", ">=", date_from), ("a.date", "<=", date_to),
+                                  ("a.cat_slug", "=", category), ("a.reference", "=", reference)):
+            if value is not None:
+                clauses.append(f"{column} {op} ?")
+                params.append(value)
+        if is_legal is not None:
+            clauses.append("a.is_legal = ?")
+            params.append(int(is_legal))
+
+        where = " AND ".join(clauses) or "1"
+        if query:
+            sql = f"""SELECT a.data FROM articles a JOIN articles_fts f ON f.rowid = a.id
+                      WHERE f.articles_fts MATCH ? AND {where} ORDER BY f.rank LIMIT ?"""
+            params = [query] + params
+        else:
+            sql = f"SELECT a.data FROM articles a WHERE {where} ORDER BY a.date DESC, a.id LIMIT ?"
+        rows = self.conn.execute(sql, params + [limit]).fetchall()
+        return [json.loads(r["data"]) for r in rows]
+
+    def by_reference(self, reference: str) -> list:
+        """Articles portant exactement cette référence."""
+        return self.search(reference=reference, limit=1000)
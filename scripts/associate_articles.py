@@ -8,6 +8,8 @@ from collections import defaultdict
 import unicodedata
 from langdetect import detect, DetectorFactory
 from utils import ensure_dir  
+from inference_client import nsp_scores_remote
+from segment_catalog import SegmentCatalog, INCOMPLETE, MATCHED
 import shutil
 
 # Pour assurer stabilité détection langue
@@ -16,12 +18,18 @@ DetectorFactory.seed = 0
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-# Charger BERT NSP
-tokenizer = BertTokenizer.from_pretrained('bert-base-multilingual-cased')
-model = BertForNextSentencePrediction.from_pretrained('bert-base-multilingual-cased')
+# BERT NSP, chargé à la première utilisation (inutile quand le serveur d'inférence est utilisé)
+tokenizer = None
+model = None
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-model.to(device)
-model.eval()
+
+def load_nsp_model():
+    global tokenizer, model
+    if model is None:
+        tokenizer = BertTokenizer.from_pretrained('bert-base-multilingual-cased')
+        model = BertForNextSentencePrediction.from_pretrained('bert-base-multilingual-cased')
+        model.to(device)
+        model.eval()
 
 def clean_text(text: str) -> str:
     if not text:
@@ -47,6 +55,7 @@ def get_nsp_score(text1: str, text2: str) -> float:
     if not text1 or not text2:
         return 0.0
     try:
+        load_nsp_model()
         inputs = tokenizer(text1, text2, return_tensors="pt", truncation=True, max_length=512)
         inputs = {k: v.to(device) for k, v in inputs.items()}
         with torch.no_grad():
@@ -58,7 +67,17 @@ def get_nsp_score(text1: str, text2: str) -> float:
         logger.error(f"Erreur calcul NSP: {e}")
         return 0.0
 
-def find_best_matches(incomplets: list, candidates: list, max_chars=1000):
+def nsp_scores_batch(pairs: list) -> list:
+    """Scores NSP d'une liste de paires (text1, text2) en un seul passage du modèle."""
+    load_nsp_model()
+    inputs = tokenizer([a for a, _ in pairs], [b for _, b in pairs], return_tensors="pt",
+                       truncation=True, max_length=512, padding=True)
+    inputs = {k: v.to(device) for k, v in inputs.items()}
+    with torch.no_grad():
+        probs = torch.softmax(model(**inputs).logits, dim=1)
+    return probs[:, 0].tolist()
+
+def find_best_matches(incomplets: list, candidates: list, max_chars=1000, inference_url: str = None):
     results = []
     used_candidates = set()
     processed_incomplets = set()
@@ -66,14 +85,21 @@ def find_best_matches(incomplets: list, candidates: list, max_chars=1000):
     incomplete_data = [(p, t[:max_chars]) for p, t, _ in incomplets]
     candidate_data = [(p, load_text(p)[0][:max_chars]) for p in candidates]
 
+    pairs = [(inc_path, inc_text, cand_path, cand_text)
+             for inc_path, inc_text in incomplete_data
+             for cand_path, cand_text in candidate_data
+             if inc_text and cand_text]
+
+    # Serveur d'inférence : toutes les paires en une requête ; sinon une paire à la fois
+    if inference_url and pairs:
+        scores = nsp_scores_remote(inference_url, [(inc_text, cand_text) for _, inc_text, _, cand_text in pairs])
+    else:
+        scores = [get_nsp_score(inc_text, cand_text) for _, inc_text, _, cand_text in pairs]
+
     similarities = defaultdict(dict)
-    for inc_path, inc_text in incomplete_data:
-        for cand_path, cand_text in candidate_data:
-            if not inc_text or not cand_text:
-                continue
-            sim = get_nsp_score(inc_text, cand_text)
-            similarities[inc_path][cand_path] = sim
-            logger.info(f"Sim {inc_path.name} <> {cand_path.name}: {sim:.4f}")
+    for (inc_path, _, cand_path, _), sim in zip(pairs, scores):
+        similarities[inc_path][cand_path] = sim
+        logger.info(f"Sim {inc_path.name} <> {cand_path.name}: {sim:.4f}")
 
     for _ in range(min(len(incomplete_data), len(candidates))):
         max_sim = -1
@@ -161,11 +187,7 @@ def combine_articles(inc_path: Path, cand_path: Path, output_dir: Path, page_num
 
 
 
-def get_page_number(filename: str) -> str:
-    m = re.search(r'_page_(\d+)_', filename)
-    return m.group(1).zfill(3) if m else "000"
-
-def associate_articles(base_folder: Path):
+def associate_articles(base_folder: Path, inference_url: str = None):
     logger.info(f"Démarrage association dans {base_folder}")
 
     ocr_dir = base_folder / "ocr_text"
@@ -177,12 +199,15 @@ def associate_articles(base_folder: Path):
         logger.error(f"ocr_text ou incomplets absent dans {base_folder}")
         return
 
+    # Segments, pages et statuts lus dans le catalogue (rempli par l'OCR et detect_incomplet)
+    catalog = SegmentCatalog.load(base_folder)
+
     # Liste des articles incomplets (article_00) à traiter
-    incomplets_list = list(incomplets_dir.glob("*article_00_*.txt"))
+    incomplets_list = [incomplets_dir / f"{r.name}.txt" for r in catalog.with_status(INCOMPLETE, cls=0)]
     logger.info(f"{len(incomplets_list)} articles incomplets trouvés.")
 
     # Liste des candidats article_01 dans ocr_text
-    candidates_list = list(ocr_dir.glob("*article_01_*.txt"))
+    candidates_list = [base_folder / r.text_path for r in catalog.with_text(cls=1)]
     logger.info(f"{len(candidates_list)} articles_01 candidats trouvés.")
 
     # Charger textes incomplets (avec langue ignorée ici)
@@ -192,7 +217,7 @@ def associate_articles(base_folder: Path):
         incomplets_texts.append((f, txt, lang))
 
     # Trouver meilleurs appariements
-    matches = find_best_matches(incomplets_texts, candidates_list)
+    matches = find_best_matches(incomplets_texts, candidates_list, inference_url=inference_url)
 
     # Assurer dossiers de sortie
     ensure_dir(output_dir)
@@ -200,15 +225,17 @@ def associate_articles(base_folder: Path):
 
     # Combiner articles appariés et créer rapport CSV
     rows = []
+    matched = []
     for m in matches:
-        page_num = get_page_number(m["article_00"])
-        article_idx_match = re.search(r"_article_00_(\d+)\.txt$", m["article_00"])
-        article_idx = article_idx_match.group(1) if article_idx_match else "0"
+        record = catalog.get(Path(m["article_00"]).stem)
+        page_num = f"{record.page:03d}"
+        article_idx = str(record.index)
 
         if m["status"] == "Matched" and m["article_01"]:
             inc_path = incomplets_dir / m["article_00"]
             cand_path = ocr_dir / m["article_01"]
             combine_articles(inc_path, cand_path, output_dir, page_num, article_idx)
+            matched.append(record.name)
 
         rows.append({
             "page": page_num,
@@ -225,5 +252,9 @@ def associate_articles(base_folder: Path):
         writer.writeheader()
         writer.writerows(rows)
 
+    with SegmentCatalog.edit(base_folder) as catalog:
+        for name in matched:
+            catalog.update(name, status=MATCHED)
+
     logger.info(f"Association terminée. Rapport: {csv_path}")
     logger.info(f"Articles combinés dans: {output_dir}")
@@ -1,5 +1,6 @@
 import shutil
 from pathlib import Path
+from segment_catalog import SegmentCatalog, INCOMPLETE, MATCHED
 
 def clean_png_files(root_path: Path):
     """Supprime seulement les PNG directement dans root_path (pas les sous-dossiers)."""
@@ -14,26 +15,23 @@ def collect_final_images(output_dir):
     segment_dir = output_dir / "segment"
     merged_dir = output_dir / "complete_articles" / "merged_images"
     incomplets_dir = output_dir / "incomplets"
+    catalog = SegmentCatalog.load(output_dir)
 
     # Cas 1 : dossier "incomplets" n'existe pas
     if not incomplets_dir.exists():
         print("[INFO] Dossier 'incomplets' introuvable → Copie de toutes les images du segment.")
-        for img_path in segment_dir.glob("*.png"):
-            shutil.copy(img_path, output_dir)
+        for record in catalog:
+            shutil.copy(segment_dir / f"{record.name}.png", output_dir)
         return
 
     # Cas 2 : dossier "incomplets" existe → traitement normal
     print("[INFO] Dossier 'incomplets' trouvé → Application du traitement complet.")
 
-    # Charger les noms des fichiers txt incomplets
-    incomplets_txt = set(f.name for f in incomplets_dir.glob("*.txt"))
-
     # 1) Images de complete_articles/merged_images avec "article_complet"
     for img_path in merged_dir.glob("*.png"):
         shutil.copy(img_path, output_dir)
 
-    # 2) Images "article_00" dont le txt n’est pas dans incomplets
-    for img_path in segment_dir.glob("*article_00*.png"):
-        txt_name = img_path.with_suffix(".txt").name
-        if txt_name not in incomplets_txt:
-            shutil.copy(img_path, output_dir)
\ No newline at end of file
+    # 2) Images "article_00" qui ne sont pas incomplètes (statut du catalogue)
+    for record in catalog.by_class(0):
+        if record.status not in (INCOMPLETE, MATCHED):
+            shutil.copy(segment_dir / f"{record.name}.png", output_dir)
\ No newline at end of file
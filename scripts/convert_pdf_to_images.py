@@ -1,4 +1,5 @@
 from pdf2image import convert_from_path
+import subprocess
 from utils import ensure_dir
 from datetime import datetime
 from pathlib import Path
@@ -6,17 +7,27 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-def convert_pdf_to_images(pdf_path: str, nom_journal: str, output_root: str = "output", config=None) -> str:
-    """Convert PDF to images and return output directory."""
+def edition_output_dir(output_root: str, nom_journal: str, date_str: str = None) -> Path:
+    """output/nom_journal/date (date du jour par défaut)."""
+    date_du_jour = date_str or datetime.today().strftime("%Y-%m-%d")
+    return Path(output_root) / nom_journal / date_du_jour
+
+
+def convert_pdf_to_images(pdf_path: str, nom_journal: str, output_root: str = "output", config=None, dpi: int = None,
+                          first_page: int = None, last_page: int = None, date_str: str = None) -> str:
+    """Convert PDF to images and return output directory.
+
+    dpi overrides config["dpi"], e.g. to render low-resolution pages for
+    layout detection only (see render_pdf_region). first_page / last_page
+    restrict the conversion to a page range; date_str fixes the edition date.
+    """
     if config is None:
         import yaml
         with open("../config/config.yaml", "r") as f:
             config = yaml.safe_load(f)
 
-    date_du_jour = datetime.today().strftime("%Y-%m-%d")
-
     # ✅ Nouvelle structure : output/nom_journal/date_du_jour
-    output_dir = Path(output_root) / nom_journal / date_du_jour
+    output_dir = edition_output_dir(output_root, nom_journal, date_str)
     ensure_dir(output_dir)
 
     if not Path(pdf_path).exists():
@@ -25,8 +36,9 @@ def convert_pdf_to_images(pdf_path: str, nom_journal: str, output_root: str = "o
 
     logger.info(f"Converting PDF: {pdf_path}")
     try:
-        images = convert_from_path(pdf_path, dpi=int(config.get("dpi", 200)))
-        for page_num, image in enumerate(images, 1):
+        images = convert_from_path(pdf_path, dpi=int(dpi or config.get("dpi", 200)),
+                                   first_page=first_page, last_page=last_page)
+        for page_num, image in enumerate(images, first_page or 1):
             image_filename = f"{nom_journal}_page_{page_num}.png"
             image_path = output_dir / image_filename
             image.save(image_path, "PNG")
@@ -37,3 +49,25 @@ def convert_pdf_to_images(pdf_path: str, nom_journal: str, output_root: str = "o
 
     logger.info(f"Conversion completed: {output_dir}")
     return str(output_dir)
+
+
+def render_pdf_region(pdf_path: str, page_num: int, box, dpi: int, output_path: Path) -> bool:
+    """Render only one region of a PDF page at the given dpi with poppler (pdftoppm -x -y -W -H).
+
+    box is (x1, y1, x2, y2) in pixels at `dpi`. Returns True on success.
+    """
+    x1, y1, x2, y2 = (int(v) for v in box)
+    output_path = Path(output_path)
+    cmd = [
+        "pdftoppm", "-png", "-singlefile",
+        "-f", str(page_num), "-l", str(page_num),
+        "-r", str(dpi),
+        "-x", str(x1), "-y", str(y1), "-W", str(max(1, x2 - x1)), "-H", str(max(1, y2 - y1)),
+        str(pdf_path), str(output_path.with_suffix("")),
+    ]
+    try:
+        subprocess.run(cmd, check=True, capture_output=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error(f"Region rendering failed for page {page_num} {box}: {e}")
+        return False
+    return True
@@ -2,15 +2,20 @@ from pathlib import Path
 import re
 import shutil
 from utils import ensure_dir
+from segment_catalog import SegmentCatalog, COMPLETE, INCOMPLETE
+from ocr_layout import OcrLayout
 
 
-def detect_reference(article_text: str) -> str:
-    """Détecte et retourne la référence si présente, sinon 'Pas de référence trouvée'."""
-    lines = [line.strip() for line in article_text.strip().split("\n") if line.strip()]
-    if not lines:
-        return "Pas de référence trouvée"
+def detect_reference(article_text: str, last_line: str = None) -> str:
+    """Détecte et retourne la référence si présente, sinon 'Pas de référence trouvée'.
+
+    last_line : dernière ligne déjà connue (mise en page OCR), le texte n'est alors pas re-découpé."""
+    if last_line is None:
+        lines = [line.strip() for line in article_text.strip().split("\n") if line.strip()]
+        if not lines:
+            return "Pas de référence trouvée"
+        last_line = lines[-1]
 
-    last_line = lines[-1]
     last_line_clean = re.sub(r"\s+", " ", last_line)
 
     date_patterns = [
@@ -29,38 +34,37 @@ def detect_reference(article_text: str) -> str:
     return "Pas de référence trouvée"
 
 
-def has_reference(file_path: Path) -> bool:
-    """Vérifie si un fichier contient une référence valide."""
-    try:
-        content = file_path.read_text(encoding="utf-8")
-        return detect_reference(content) != "Pas de référence trouvée"
-    except Exception as e:
-        print(f"Erreur lecture fichier {file_path.name} : {e}")
-        return False
-
-
 def detect_incomplete_articles(output_dir: Path):
     """Détecte et copie les articles incomplets dans un dossier 'incomplets'.
-       Supposé être appelé uniquement si des article_01 existent."""
-    
-    ocr_dir = output_dir / "ocr_text"
-    if not ocr_dir.exists():
-        print(f"Dossier OCR introuvable : {ocr_dir}")
-        return
+       Supposé être appelé uniquement si des article_01 existent.
+       La référence et le statut (complet / incomplet) de chaque article_00
+       sont enregistrés dans le catalogue des segments."""
 
-    files_00 = list(ocr_dir.glob("**/*article_00_*.txt"))
-    if not files_00:
-        print("Aucun fichier article_00 trouvé.")
-        return
+    with SegmentCatalog.edit(output_dir) as catalog:
+        records_00 = catalog.with_text(cls=0)
+        if not records_00:
+            print("Aucun fichier article_00 trouvé.")
+            return
 
-    incomplete_dir = ensure_dir(output_dir / "incomplets")
-    print(f"\nAnalyse de {len(files_00)} fichiers dans : {ocr_dir}\n")
+        incomplete_dir = ensure_dir(output_dir / "incomplets")
+        layout = OcrLayout(output_dir)  # dernière ligne Vision, sans relire ni découper le texte
+        print(f"\nAnalyse de {len(records_00)} fichiers dans : {output_dir / 'ocr_text'}\n")
 
-    for f in sorted(files_00):
-        if not has_reference(f):
-            print(f"🔸 Incomplet : {f.name}")
-            shutil.copy(f, incomplete_dir / f.name)
-        else:
-            print(f"✅ Complet   : {f.name}")
+        for record in records_00:
+            f = output_dir / record.text_path
+            last_line = layout.last_line(record.name)
+            try:
+                text = "" if last_line is not None else f.read_text(encoding="utf-8")
+                reference = detect_reference(text, last_line)
+            except Exception as e:
+                print(f"Erreur lecture fichier {f.name} : {e}")
+                reference = "Pas de référence trouvée"
+            if reference == "Pas de référence trouvée":
+                print(f"🔸 Incomplet : {f.name}")
+                shutil.copy(f, incomplete_dir / f.name)
+                record.reference, record.status = None, INCOMPLETE
+            else:
+                print(f"✅ Complet   : {f.name}")
+                record.reference, record.status = reference, COMPLETE
 
     print(f"\n📂 Articles incomplets copiés dans : {incomplete_dir}")
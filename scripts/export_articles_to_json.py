@@ -2,14 +2,19 @@ import json
 import time
 from pathlib import Path
 import re
+from tqdm import tqdm
+from article_store import ArticleStore
+from segment_catalog import SegmentCatalog, INCOMPLETE, MATCHED
+from ocr_layout import OcrLayout
 
-def detect_reference(article_text: str) -> str:
-    """Détecte la référence si elle existe."""
-    lines = [line.strip() for line in article_text.strip().split("\n") if line.strip()]
-    if not lines:
-        return "Pas de référence trouvée"
+def detect_reference(article_text: str, last_line: str = None) -> str:
+    """Détecte la référence si elle existe (last_line : dernière ligne issue de la mise en page OCR)."""
+    if last_line is None:
+        lines = [line.strip() for line in article_text.strip().split("\n") if line.strip()]
+        if not lines:
+            return "Pas de référence trouvée"
+        last_line = lines[-1]
 
-    last_line = lines[-1]
     last_line_clean = re.sub(r"\s+", " ", last_line)
 
     date_patterns = [
@@ -43,8 +48,12 @@ def extract_page_from_filename(filename: str):
     match = re.search(r'_page_(\d+)', filename)
     return match.group(1) if match else None
 
-def export_articles_to_json(complete_dir: Path, ocr_dir: Path, incomplets_dir: Path, output_json_path: Path):
-    """Exporte les articles selon la présence ou non d'articles incomplets."""
+def iter_articles(complete_dir: Path):
+    """Génère les articles un par un selon la présence ou non d'articles incomplets.
+
+    Les segments, leurs textes, leurs pages et leur statut (incomplet ou non)
+    viennent du catalogue des segments de l'édition (segment_catalog).
+    """
     date_folder = complete_dir.parent
     nom_journal = date_folder.parent.name
     date_str = extract_date_from_folder(date_folder)
@@ -53,28 +62,28 @@ def export_articles_to_json(complete_dir: Path, ocr_dir: Path, incomplets_dir: P
     # Dossier parent des images PNG
     images_dir = date_folder
 
-    articles = []
+    catalog = SegmentCatalog.load(date_folder)
+    layout = OcrLayout(date_folder)
 
     # Vérifier présence article_01
-    has_article_01 = any(ocr_dir.glob("*article_01_*.txt"))
+    has_article_01 = bool(catalog.with_text(cls=1))
 
-    # Liste des articles incomplets
-    incomplets_files = set()
-    if incomplets_dir.exists():
-        incomplets_files = {f.name for f in incomplets_dir.glob("*article_00_*.txt")}
+    def build_article(txt_path: Path, page=None, reference: str = None, last_line: str = None):
+        """Construit l'entrée d'un article, ou None si le texte est vide.
 
-    def add_article(txt_path: Path):
-        """Ajoute un article au tableau final."""
+        page / reference : déjà connus par le catalogue pour les segments.
+        last_line : dernière ligne issue de la mise en page OCR (ocr_layout).
+        """
         content = txt_path.read_text(encoding="utf-8").strip()
         if not content:
-            return
+            return None
 
-        reference = detect_reference(content)
-        page = extract_page_from_filename(txt_path.name)
+        reference = reference or detect_reference(content, last_line)
+        page = page or extract_page_from_filename(txt_path.name)
         image_name = txt_path.stem + ".png"  # même nom que le txt
         image_path = images_dir / image_name
 
-        articles.append({
+        return {
             "title": f"{nom_journal} - {langue} - {date_str} - {reference}",
             "reference": reference,
             "lang": langue,
@@ -86,32 +95,177 @@ def export_articles_to_json(complete_dir: Path, ocr_dir: Path, incomplets_dir: P
             "cat": {},
             "page": str(page) if page else None,
             "extras": None
-        })
+        }
 
     if not has_article_01:
-        # Cas simple : tous les txt de ocr_text
-        for txt_path in ocr_dir.glob("*.txt"):
-            add_article(txt_path)
+        # Cas simple : tous les segments avec texte
+        records = catalog.with_text()
     else:
         # 1. Articles article_00 qui ne sont pas incomplets
-        for txt_path in ocr_dir.glob("*article_00_*.txt"):
-            if txt_path.name not in incomplets_files:
-                add_article(txt_path)
+        records = [r for r in catalog.with_text(cls=0) if r.status not in (INCOMPLETE, MATCHED)]
+
+    for record in records:
+        article = build_article(date_folder / record.text_path, record.page, record.reference,
+                                layout.last_line(record.name))
+        if article is not None:
+            yield article
 
+    if has_article_01:
         # 2. Articles complets fusionnés
         for subdir in complete_dir.glob("article_complet_*"):
             if subdir.is_dir():
                 for txt_path in subdir.glob("*.txt"):
-                    add_article(txt_path)
+                    article = build_article(txt_path)
+                    if article is not None:
+                        yield article
 
-    # Structure finale
-    output_data = {
+
+def build_header(complete_dir: Path) -> dict:
+    """En-tête du document exporté (identique en JSON et en NDJSON)."""
+    date_folder = complete_dir.parent
+    nom_journal = date_folder.parent.name
+    date_str = extract_date_from_folder(date_folder)
+    return {
         "doc_id": date_str,
         "doc_type": nom_journal,
         "creation_date": int(time.time()),
-        "articles": articles
     }
 
+
+def export_articles_to_json(complete_dir: Path, output_json_path: Path, store_path: Path = None):
+    """Exporte les articles selon la présence ou non d'articles incomplets.
+
+    Avec store_path, l'édition est aussi ingérée dans la base d'articles (article_store).
+    """
+    articles = list(iter_articles(complete_dir))
+
+    # Structure finale
+    output_data = build_header(complete_dir)
+    output_data["articles"] = articles
+
     # Sauvegarde JSON
     output_json_path.write_text(json.dumps(output_data, ensure_ascii=False, indent=4), encoding="utf-8")
     print(f"✅ JSON généré : {output_json_path} ({len(articles)} articles)")
+
+    if store_path:
+        store = ArticleStore(store_path)
+        store.ingest_edition(output_data, articles)
+        store.close()
+
+
+# === Mode NDJSON (une ligne JSON compacte par article) ===
+# Ligne 1 : {"record": "header", ...}, puis {"record": "article", ...} par article,
+# puis {"record": "summary", "articles": N} une fois l'export terminé.
+# Les articles ne sont jamais tous en mémoire. Avec classifiers, chaque lot
+# d'articles est classifié (légalité puis catégories) avant d'être écrit : une
+# ligne écrite est définitive et le fichier peut être lu pendant l'export
+# (tail -f) ; la ligne summary, toujours la dernière, signale la fin.
+
+# Articles classifiés par lots : un seul appel au modèle (une seule requête HTTP
+# avec le serveur d'inférence) pour tout le lot, au lieu d'un appel par article.
+CLASSIFY_BATCH_SIZE = 64
+
+
+def _ndjson_line(record: dict) -> str:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def export_articles_to_ndjson(complete_dir: Path, output_ndjson_path: Path, store_path: Path = None,
+                              classifiers=()):
+    """Exporte les articles en NDJSON, un article par ligne, sans les garder en mémoire.
+
+    classifiers : fonctions classify_batch(articles) appliquées dans l'ordre à
+    chaque lot de CLASSIFY_BATCH_SIZE articles avant son écriture (voir
+    predict_legality.legality_classifier et predict_categories.category_classifier).
+    """
+    count = 0
+    header = build_header(complete_dir)
+    with output_ndjson_path.open("w", encoding="utf-8") as f, tqdm(desc="📝 Export NDJSON") as progress:
+        f.write(_ndjson_line({"record": "header", **header}))
+        f.flush()
+        batch = []
+
+        def flush():
+            for classify in classifiers:
+                classify(batch)
+            for article in batch:
+                f.write(_ndjson_line({"record": "article", **article}))
+            f.flush()
+            progress.update(len(batch))
+            batch.clear()
+
+        for article in iter_articles(complete_dir):
+            batch.append(article)
+            count += 1
+            if len(batch) >= CLASSIFY_BATCH_SIZE:
+                flush()
+        if batch:
+            flush()
+        f.write(_ndjson_line({"record": "summary", "articles": count}))
+
+    print(f"✅ NDJSON généré : {output_ndjson_path} ({count} articles)")
+
+    if store_path:
+        store = ArticleStore(store_path)
+        store.ingest_edition(header, (r for r in iter_ndjson_records(output_ndjson_path)
+                                      if r.get("record") == "article"))
+        store.close()
+
+
+def iter_ndjson_records(ndjson_path: Path):
+    """Lit un fichier NDJSON ligne par ligne sans le charger en mémoire."""
+    with ndjson_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def update_ndjson_articles(ndjson_path: Path, update_articles, store_path: Path = None, desc: str = None,
+                           batch_size: int = CLASSIFY_BATCH_SIZE):
+    """Réécrit un fichier NDJSON en appliquant update_articles(lot) aux articles, par lots de batch_size.
+
+    Sert à reclassifier un fichier déjà exporté (classify_articles,
+    classify_categories) ; le pipeline, lui, classe à l'export.
+
+    Les enregistrements header/summary sont recopiés tels quels. Le fichier
+    est réécrit dans un fichier temporaire puis remplacé atomiquement (nouveau
+    fichier : un lecteur ouvert sur l'ancien ne voit pas la mise à jour).
+    desc : libellé de la barre de progression tqdm.
+    Avec store_path, les articles mis à jour sont reportés dans la base d'articles.
+    """
+    with ndjson_path.open("r", encoding="utf-8") as f:
+        total = sum(1 for line in f if line.strip()) - 2  # header et summary
+    tmp_path = ndjson_path.with_suffix(ndjson_path.suffix + ".tmp")
+    with tmp_path.open("w", encoding="utf-8") as out, tqdm(total=max(total, 0), desc=desc) as progress:
+        batch = []
+
+        def flush():
+            update_articles(batch)
+            for article in batch:
+                out.write(_ndjson_line(article))
+            progress.update(len(batch))
+            batch.clear()
+
+        for record in iter_ndjson_records(ndjson_path):
+            if record.get("record") == "article":
+                batch.append(record)
+                if len(batch) >= batch_size:
+                    flush()
+                continue
+            if batch:
+                flush()
+            out.write(_ndjson_line(record))
+        if batch:
+            flush()
+    tmp_path.replace(ndjson_path)
+
+    if store_path:
+        update_store_classification(store_path, (r for r in iter_ndjson_records(ndjson_path)
+                                                 if r.get("record") == "article"))
+
+
+def update_store_classification(store_path: Path, articles):
+    """Reporte is_legal / cat des articles classifiés dans la base d'articles."""
+    store = ArticleStore(store_path)
+    store.update_classification(articles)
+    store.close()
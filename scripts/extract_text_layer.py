@@ -0,0 +1,138 @@
+import html
+import re
+import subprocess
+import unicodedata
+from pathlib import Path
+import logging
+from segment_catalog import SegmentCatalog, OCR_DONE
+from ocr_layout import drop_segments
+from utils import ensure_dir
+
+logger = logging.getLogger(__name__)
+
+ARABIC_RE = re.compile(r'[\u0600-\u06FF\u0750-\u077F\uFB50-\uFDFF\uFE70-\uFEFF]')
+LATIN_RE = re.compile(r'[A-Za-z\u00C0-\u00FF]')
+
+PAGE_RE = re.compile(r'<page width="([\d.]+)" height="([\d.]+)">')
+WORD_RE = re.compile(r'<word xMin="([\d.]+)" yMin="([\d.]+)" xMax="([\d.]+)" yMax="([\d.]+)">(.*?)</word>')
+
+
+def read_pdf_words(pdf_path: str, first_page: int = None, last_page: int = None) -> dict:
+    """Return {page_num: (width_pt, height_pt, words)} from the PDF text layer.
+
+    words is a list of (x1, y1, x2, y2, text) in PDF points, read with
+    poppler's `pdftotext -bbox`. Returns {} if the text layer cannot be read.
+    """
+    cmd = ["pdftotext", "-bbox"]
+    if first_page:
+        cmd += ["-f", str(first_page)]
+    if last_page:
+        cmd += ["-l", str(last_page)]
+    try:
+        out = subprocess.run(cmd + [str(pdf_path), "-"],
+                             check=True, capture_output=True).stdout.decode("utf-8", errors="replace")
+    except (OSError, subprocess.CalledProcessError) as e:
+        logger.error(f"pdftotext failed for {pdf_path}: {e}")
+        return {}
+
+    pages = {}
+    for page_num, chunk in enumerate(out.split("</page>")[:-1], first_page or 1):
+        m = PAGE_RE.search(chunk)
+        if not m:
+            continue
+        words = []
+        for w in WORD_RE.finditer(chunk):
+            # NFKC folds Arabic presentation forms (FBxx-FExx) back to base letters
+            text = unicodedata.normalize("NFKC", html.unescape(w.group(5))).strip()
+            if text:
+                words.append((float(w.group(1)), float(w.group(2)), float(w.group(3)), float(w.group(4)), text))
+        pages[page_num] = (float(m.group(1)), float(m.group(2)), words)
+    return pages
+
+
+def _is_rtl(words: list) -> bool:
+    sample = " ".join(w[4] for w in words)
+    return len(ARABIC_RE.findall(sample)) > len(LATIN_RE.findall(sample))
+
+
+def region_text(words: list, box) -> str:
+    """Text of the words whose center falls inside box (points), in reading order.
+
+    Words are grouped into lines by vertical position; each line is ordered
+    right-to-left when it is mostly Arabic, left-to-right otherwise.
+    """
+    x1, y1, x2, y2 = box
+    inside = [w for w in words if x1 <= (w[0] + w[2]) / 2 <= x2 and y1 <= (w[1] + w[3]) / 2 <= y2]
+    if not inside:
+        return ""
+
+    inside.sort(key=lambda w: (w[1] + w[3]) / 2)
+    lines, current = [], [inside[0]]
+    for w in inside[1:]:
+        last = current[-1]
+        if (w[1] + w[3]) / 2 - (last[1] + last[3]) / 2 > 0.5 * min(w[3] - w[1], last[3] - last[1]):
+            lines.append(current)
+            current = [w]
+        else:
+            current.append(w)
+    lines.append(current)
+
+    text_lines = []
+    for line in lines:
+        rtl = _is_rtl(line)
+        line.sort(key=lambda w: -w[2] if rtl else w[0])
+        text_lines.append(" ".join(w[4] for w in line))
+    return "\n".join(text_lines)
+
+
+def is_usable_text(text: str, min_chars: int = 20) -> bool:
+    """Reject empty regions and broken text layers (unmapped glyphs, (cid:NN) codes)."""
+    cleaned = re.sub(r'\s+', '', text)
+    if len(cleaned) < min_chars:
+        return False
+    broken = cleaned.count("\ufffd") + len(re.findall(r'\(cid:\d+\)', cleaned)) * 8
+    letters = sum(1 for c in cleaned if c.isalpha())
+    return broken / len(cleaned) < 0.05 and letters / len(cleaned) > 0.5
+
+
+def extract_segments_text_layer(pdf_path: str, segment_dir: Path, output_text_dir: Path,
+                                min_chars: int = 20, min_page_words: int = 20, pages: set = None) -> set:
+    """Write ocr_text/<segment>.txt from the PDF text layer where it is usable.
+
+    Pages with fewer than min_page_words words are treated as scanned. Returns
+    the set of segment stems handled here; the remaining ones still need OCR.
+    pages restricts the run to these page numbers.
+    """
+    edition_dir = Path(segment_dir).parent
+    catalog = SegmentCatalog.load(edition_dir)
+    # Les catalogues reconstruits depuis les noms de fichiers n'ont pas la géométrie des boîtes
+    records = [r for r in catalog if r.page_width and (pages is None or r.page in pages)]
+    if not records:
+        logger.warning(f"No segment geometry in the catalog of {edition_dir}, text layer skipped")
+        return set()
+
+    page_nums = [r.page for r in records]
+    pdf_pages = read_pdf_words(pdf_path, min(page_nums), max(page_nums))
+    output_text_dir = ensure_dir(output_text_dir)
+    handled = set()
+    for record in records:
+        page = pdf_pages.get(record.page)
+        if page is None or len(page[2]) < min_page_words:
+            continue
+        width_pt, height_pt, words = page
+        sx, sy = width_pt / record.page_width, height_pt / record.page_height
+        box = (record.x1 * sx, record.y1 * sy, record.x2 * sx, record.y2 * sy)
+        text = region_text(words, box)
+        if not is_usable_text(text, min_chars):
+            continue
+        (output_text_dir / f"{record.name}.txt").write_text(text, encoding="utf-8")
+        handled.add(record.name)
+
+    if handled:
+        # Une mise en page Vision d'un passage précédent ne correspond plus à ce texte
+        drop_segments(edition_dir, handled)
+        with SegmentCatalog.edit(edition_dir) as catalog:
+            for name in handled:
+                catalog.update(name, text_path=f"{output_text_dir.name}/{name}.txt", status=OCR_DONE)
+    logger.info(f"Text layer: {len(handled)}/{len(records)} segments extracted without OCR")
+    return handled
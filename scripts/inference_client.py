@@ -0,0 +1,47 @@
+# Clients légers du serveur d'inférence local (inference_server.py).
+import json
+from pathlib import Path
+import urllib.request
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def _post(url: str, endpoint: str, payload: dict, timeout: float = 600) -> dict:
+    request = urllib.request.Request(
+        url.rstrip("/") + endpoint,
+        data=json.dumps(payload, ensure_ascii=False).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def detect_remote(url: str, image_paths: list) -> list:
+    """YOLO sur des images locales. Pour chaque image : (boxes, classes) ou None si rien n'est détecté.
+
+    Les chemins sont envoyés en absolu : le serveur n'a pas le même dossier courant que le client.
+    """
+    results = _post(url, "/detect", {"images": [str(Path(p).resolve()) for p in image_paths]})["results"]
+    return [(r["boxes"], r["classes"]) if r["boxes"] else None for r in results]
+
+
+def nsp_scores_remote(url: str, pairs: list) -> list:
+    """Probabilités NSP (text2 suit text1) pour une liste de paires (text1, text2)."""
+    return _post(url, "/nsp", {"pairs": [list(p) for p in pairs]})["scores"]
+
+
+class RemoteClassifier:
+    """Remplaçant d'un pipeline transformers "text-classification" servi par le serveur d'inférence.
+
+    Même appel que le pipeline : classifier(text ou [textes], ...) → [{"label", "score"}, ...].
+    """
+
+    def __init__(self, url: str, model: str):
+        self.url = url
+        self.model = model
+
+    def __call__(self, texts, **kwargs):
+        if isinstance(texts, str):
+            texts = [texts]
+        return _post(self.url, "/classify", {"model": self.model, "texts": texts})["results"]
@@ -0,0 +1,180 @@
+# Serveur d'inférence local : garde YOLO, BERT NSP et les deux classifieurs
+# RoBERTa chargés en mémoire entre les éditions.
+#
+#   python inference_server.py      (puis inference_server_url: "http://127.0.0.1:8765" dans config.yaml)
+#
+# Les requêtes concurrentes vers un même modèle sont regroupées en un seul lot
+# (MicroBatcher) avant l'inférence.
+import json
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import cv2
+import yaml
+from transformers import pipeline
+from ultralytics import YOLO
+
+logger = logging.getLogger(__name__)
+
+CLASSIFIER_MODELS = {
+    "legality": Path("../models/legal_classifier_roberta_ADA"),
+    "category": Path("../models/roberta_multiclass_classifier"),
+}
+
+
+class MicroBatcher:
+    """Regroupe les requêtes concurrentes en lots d'au plus max_batch éléments.
+
+    Un seul thread exécute fn(items) -> results (même longueur) ; chaque
+    appelant de submit() récupère sa part des résultats. Une requête plus
+    grande que max_batch (ex. toutes les paires NSP d'une édition) est
+    découpée : fn ne reçoit jamais plus de max_batch éléments à la fois.
+    """
+
+    def __init__(self, fn, max_batch: int = 16, max_wait: float = 0.01):
+        self.fn = fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        threading.Thread(target=self._loop, daemon=True).start()
+
+    def submit(self, items: list) -> list:
+        if not items:
+            return []
+        future = Future()
+        self.requests.put((items, future))
+        return future.result()
+
+    def _loop(self):
+        while True:
+            pending = [self.requests.get()]
+            size = len(pending[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                pending.append(request)
+                size += len(request[0])
+
+            items = [item for request_items, _ in pending for item in request_items]
+            try:
+                results = []
+                for start in range(0, len(items), self.max_batch):
+                    results += list(self.fn(items[start:start + self.max_batch]))
+            except Exception as e:
+                logger.exception("Batch inference failed")
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+
+            offset = 0
+            for request_items, future in pending:
+                future.set_result(results[offset:offset + len(request_items)])
+                offset += len(request_items)
+
+
+def build_batchers(config: dict) -> dict:
+    """Charge tous les modèles une fois et crée un MicroBatcher par modèle."""
+    import associate_articles
+
+    max_batch = int(config.get("inference_max_batch", 16))
+    max_wait = float(config.get("inference_max_wait_ms", 10)) / 1000
+
+    yolo = YOLO(config["model_path"])
+
+    def detect(paths):
+        images = [cv2.imread(p) for p in paths]
+        results = yolo([img for img in images if img is not None])
+        results_iter = iter(results)
+        out = []
+        for img in images:
+            r = next(results_iter) if img is not None else None
+            if r is None or not r.boxes:
+                out.append({"boxes": [], "classes": []})
+                continue
+            out.append({
+                "boxes": r.boxes.xyxy.cpu().numpy().astype(int).tolist(),
+                "classes": r.boxes.cls.cpu().numpy().astype(int).tolist(),
+            })
+        return out
+
+    associate_articles.load_nsp_model()
+
+    batchers = {
+        "detect": MicroBatcher(detect, max_batch, max_wait),
+        "nsp": MicroBatcher(associate_articles.nsp_scores_batch, max_batch, max_wait),
+    }
+    for name, model_dir in CLASSIFIER_MODELS.items():
+        classifier = pipeline("text-classification", model=str(model_dir), tokenizer=str(model_dir))
+        batchers[name] = MicroBatcher(
+            lambda texts, c=classifier: c(texts, truncation=True, max_length=512, batch_size=len(texts)),
+            max_batch, max_wait)
+    return batchers
+
+
+def make_handler(batchers: dict):
+    class InferenceHandler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._reply(200, {"status": "ok", "models": sorted(batchers)})
+            else:
+                self._reply(404, {"error": "not found"})
+
+        def do_POST(self):
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                payload = json.loads(self.rfile.read(length).decode("utf-8"))
+                if self.path == "/detect":
+                    self._reply(200, {"results": batchers["detect"].submit(payload["images"])})
+                elif self.path == "/nsp":
+                    pairs = [tuple(p) for p in payload["pairs"]]
+                    self._reply(200, {"scores": batchers["nsp"].submit(pairs)})
+                elif self.path == "/classify":
+                    if payload.get("model") not in CLASSIFIER_MODELS:
+                        self._reply(400, {"error": f"unknown model: {payload.get('model')}"})
+                        return
+                    self._reply(200, {"results": batchers[payload["model"]].submit(payload["texts"])})
+                else:
+                    self._reply(404, {"error": "not found"})
+            except Exception as e:
+                logger.exception(f"Request {self.path} failed")
+                self._reply(500, {"error": repr(e)})
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return InferenceHandler
+
+
+def serve(config: dict):
+    host = config.get("inference_server_host", "127.0.0.1")
+    port = int(config.get("inference_server_port", 8765))
+    batchers = build_batchers(config)
+    server = ThreadingHTTPServer((host, port), make_handler(batchers))
+    logger.info(f"Serveur d'inférence prêt sur http://{host}:{port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open("../config/config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    serve(config)
@@ -0,0 +1,134 @@
+import json
+import sqlite3
+import time
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Gabarits de mise en page par journal et numéro de page. Les pages d'annonces
+# d'un même journal gardent presque la même grille de colonnes d'une édition à
+# l'autre : les boîtes YOLO d'une édition précédente sont réutilisées quand un
+# contrôle structurel rapide confirme qu'elles correspondent encore à la page.
+#
+# Contrôle (sur la page réduite et binarisée) :
+# - profil de projection vertical (encre par colonne) corrélé à celui de la
+#   page d'origine du gabarit → même grille de colonnes et mêmes gouttières ;
+# - bords de chaque boîte dans du blanc : un bord qui coupe des lignes de texte
+#   signifie que les annonces ont changé de hauteur. Les filets (bord entièrement
+#   encré) sont acceptés.
+# En cas d'échec, YOLO tourne normalement et le gabarit est remplacé.
+DEFAULT_SETTINGS = {
+    "min_similarity": 0.9,   # corrélation minimale des profils verticaux
+    "max_edge_ink": 0.08,    # part maximale d'encre sur un bord de boîte
+    "max_size_diff": 0.02,   # écart relatif maximal des proportions de la page
+    "refresh_every": 20,     # YOLO forcé après ce nombre de réutilisations consécutives
+}
+MAX_SIDE = 1000  # les pages sont réduites à cette taille avant le contrôle
+PROFILE_BINS = 256
+RULE_COVERAGE = 0.9  # bord encré sur plus de cette part de sa longueur : filet, pas du texte
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS templates (
+    journal TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    boxes TEXT NOT NULL,
+    classes TEXT NOT NULL,
+    profile TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (journal, page)
+);
+"""
+
+
+def _binarize(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    scale = MAX_SIDE / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return binary
+
+
+def vertical_profile(binary) -> np.ndarray:
+    """Encre par colonne, ré-échantillonnée sur PROFILE_BINS valeurs."""
+    profile = binary.mean(axis=0)
+    return np.interp(np.linspace(0, len(profile) - 1, PROFILE_BINS), np.arange(len(profile)), profile)
+
+
+def _edge_ink(binary, box) -> float:
+    """Plus grande part d'encre le long des quatre bords d'une boîte (coordonnées relatives)."""
+    h, w = binary.shape
+    x1, y1, x2, y2 = (int(round(v * s)) for v, s in zip(box, (w, h, w, h)))
+    x1, x2 = max(0, min(x1, w - 1)), max(0, min(x2, w - 1))
+    y1, y2 = max(0, min(y1, h - 1)), max(0, min(y2, h - 1))
+    if x2 - x1 < 3 or y2 - y1 < 3:
+        return 1.0
+    edges = [
+        binary[max(0, y1 - 1):y1 + 2, x1:x2].max(axis=0),
+        binary[max(0, y2 - 1):y2 + 2, x1:x2].max(axis=0),
+        binary[y1:y2, max(0, x1 - 1):x1 + 2].max(axis=1),
+        binary[y1:y2, max(0, x2 - 1):x2 + 2].max(axis=1),
+    ]
+    coverages = [float(e.mean()) for e in edges]
+    return max((c for c in coverages if c < RULE_COVERAGE), default=0.0)
+
+
+class LayoutTemplates:
+    """Index SQLite des boîtes YOLO par (journal, page), partagé entre les éditions."""
+
+    def __init__(self, db_path, settings: dict = None):
+        self.settings = {**DEFAULT_SETTINGS, **(settings or {})}
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(db_path), timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def match(self, journal: str, page: int, image):
+        """(boxes, classes) du gabarit si la page y correspond encore, sinon None."""
+        row = self.conn.execute("SELECT * FROM templates WHERE journal = ? AND page = ?",
+                                (journal, page)).fetchone()
+        if row is None or row["hits"] >= self.settings["refresh_every"]:
+            return None
+
+        height, width = image.shape[:2]
+        aspect, template_aspect = width / height, row["width"] / row["height"]
+        if abs(aspect - template_aspect) > self.settings["max_size_diff"] * template_aspect:
+            return None
+
+        binary = _binarize(image)
+        similarity = float(np.corrcoef(vertical_profile(binary), json.loads(row["profile"]))[0, 1])
+        if not similarity >= self.settings["min_similarity"]:  # aussi faux pour NaN (page blanche)
+            logger.info(f"Layout template {journal} p.{page}: columns differ ({similarity:.3f})")
+            return None
+
+        boxes = json.loads(row["boxes"])
+        edge_ink = max((_edge_ink(binary, box) for box in boxes), default=1.0)
+        if edge_ink > self.settings["max_edge_ink"]:
+            logger.info(f"Layout template {journal} p.{page}: box edges cut through text ({edge_ink:.3f})")
+            return None
+
+        self.conn.execute("UPDATE templates SET hits = hits + 1 WHERE journal = ? AND page = ?", (journal, page))
+        scale = np.array([width, height, width, height], dtype=np.float64)
+        return (np.array(boxes) * scale).round().astype(int), np.array(json.loads(row["classes"]), dtype=int)
+
+    def store(self, journal: str, page: int, image, boxes, classes):
+        """Enregistre (ou remplace) le gabarit à partir des boîtes YOLO d'une page."""
+        height, width = image.shape[:2]
+        scale = np.array([width, height, width, height], dtype=np.float64)
+        relative = (np.asarray(boxes, dtype=np.float64) / scale).round(5).tolist()
+        profile = vertical_profile(_binarize(image)).round(5).tolist()
+        self.conn.execute(
+            """INSERT OR REPLACE INTO templates (journal, page, width, height, boxes, classes, profile, hits, updated_at)
+               VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)""",
+            (journal, page, width, height, json.dumps(relative), json.dumps([int(c) for c in classes]),
+             json.dumps(profile), time.time()))
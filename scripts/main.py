@@ -1,53 +1,86 @@
 # C:\Users\chaym\Desktop\PFE\extraction_articles\scripts\main.py
 from convert_pdf_to_images import convert_pdf_to_images
-from segment_articles_with_yolo import segment_articles_with_yolo
+from segment_articles_with_yolo import segment_articles_with_yolo, segment_articles_with_yolo_parallel
 from ocr_articles import apply_ocr_to_segmented_images
+from extract_text_layer import extract_segments_text_layer
 from detect_incomplet import detect_incomplete_articles
 from associate_articles import associate_articles
-from export_articles_to_json import export_articles_to_json
-from predict_legality import classify_articles
-from predict_categories import classify_categories
+from export_articles_to_json import export_articles_to_json, export_articles_to_ndjson
+from predict_legality import classify_articles, legality_classifier
+from predict_categories import classify_categories, category_classifier
 from merge_images import merge_images_in_folder
 from clean_output import clean_png_files, collect_final_images
+from segment_catalog import SegmentCatalog
 from pathlib import Path
 import yaml
 
-if __name__ == "__main__":
-    # === Configuration utilisateur ===
-    with open("../config/config.yaml", "r") as f:
-        config = yaml.safe_load(f)
-    pdf_path = config["pdf_path"]
-    nom_journal = config["nom_journal"]
-    model_path = config["model_path"]
-    output_root = config["output_root"]
 
-    
-    # Étape 1 : Convertir PDF en images
-    output_dir = convert_pdf_to_images(pdf_path, nom_journal, output_root)
-    if output_dir is None:
-        print(f"Échec lors de la conversion du PDF {pdf_path}. Vérifiez le fichier ou les dépendances.")
-        exit(1)
-    output_dir = Path(output_dir)  # Convert to Path only if successful
+# Les étapes sont découpées en fonctions pour pouvoir être exécutées soit
+# à la suite (ci-dessous), soit page par page par les workers de queue_worker.py.
 
-    # Étape 2 : Passer les images sur YOLOv8
-    segment_articles_with_yolo(output_dir, model_path, config.get("yolo_batch_size", 10))
+def run_segmentation(output_dir: Path, pdf_path: str, config: dict, pages: set = None, model=None):
+    """Étape 2 : Passer les images sur YOLOv8.
 
-    # Étape 3 : Segments → OCR
+    model : instance YOLO déjà chargée (workers de queue_worker.py), réutilisée d'une page à l'autre.
+    """
+    # Mode deux résolutions : pages rendues à detect_dpi pour YOLO, zone des segments re-rendue à dpi depuis le PDF
+    detect_dpi = config.get("detect_dpi")
+    segment_kwargs = dict(pdf_path=pdf_path, detect_dpi=int(detect_dpi), crop_dpi=int(config.get("dpi", 200))) if detect_dpi else {}
+    # Filtre des segments sans texte (photos, logos, zones vides) avant l'OCR
+    segment_filter = config.get("segment_filter") or {}
+    if segment_filter.get("enabled", False):
+        segment_kwargs["segment_filter"] = segment_filter
+    # Gabarits de mise en page par journal : YOLO seulement si la grille de la page a changé
+    layout_templates = config.get("layout_templates") or {}
+    if layout_templates.get("enabled", False):
+        segment_kwargs["layout_templates"] = layout_templates
+    inference_url = config.get("inference_server_url")
+    yolo_workers = int(config.get("yolo_workers", 1))
+    if inference_url:
+        # YOLO déjà chargé dans le serveur d'inférence, qui regroupe les pages en lots
+        segment_articles_with_yolo(output_dir, config["model_path"], config.get("yolo_batch_size", 10),
+                                   pages=pages, inference_url=inference_url, **segment_kwargs)
+    elif model is None and yolo_workers > 1 and (pages is None or len(pages) > 1):
+        # Pas de pool de processus pour une seule page
+        segment_articles_with_yolo_parallel(output_dir, config["model_path"], yolo_workers,
+                                            int(config.get("yolo_torch_threads", 1)),
+                                            config.get("yolo_batch_size", 10), pages=pages, **segment_kwargs)
+    else:
+        segment_articles_with_yolo(output_dir, config["model_path"], config.get("yolo_batch_size", 10),
+                                   pages=pages, model=model, **segment_kwargs)
+
+
+def run_ocr(output_dir: Path, pdf_path: str, config: dict, pages: set = None):
+    """Étape 3 : Segments → OCR."""
     segment_dir = output_dir / "segment"
     output_text_dir = output_dir / "ocr_text"
-    apply_ocr_to_segmented_images(segment_dir, output_text_dir, config.get("ocr_language_hints", ["ar", "fr"]))
+    # PDF numériques : texte extrait directement de la couche texte, OCR seulement pour le reste
+    text_layer_stems = set()
+    if config.get("use_text_layer", False):
+        text_layer_stems = extract_segments_text_layer(pdf_path, segment_dir, output_text_dir,
+                                                       int(config.get("text_layer_min_chars", 20)), pages=pages)
+    language_hints = config.get("ocr_language_hints", ["ar", "fr"])
+    # Cache pHash : segments déjà vus dans une édition précédente → texte OCR réutilisé
+    cache_kwargs = dict(cache_path=config.get("segment_cache_path"),
+                        cache_max_distance=int(config.get("segment_cache_max_distance", 3)),
+                        cache_max_thumb_diff=float(config.get("segment_cache_max_thumb_diff", 0.01)),
+                        source=output_dir.parent.name)
+    apply_ocr_to_segmented_images(segment_dir, output_text_dir, language_hints, skip_stems=text_layer_stems,
+                                  pages=pages, **cache_kwargs)
+
 
-    # Vérifier s'il y a des articles_01 dans ocr_text
-    article_01_files = list(output_text_dir.glob("*article_01_*.txt"))
-    no_article_01 = len(article_01_files) == 0
+def finalize_edition(output_dir: Path, config: dict):
+    """Étapes 4 à 9, une fois toutes les pages de l'édition passées à l'OCR."""
+    # Vérifier s'il y a des articles_01 avec texte (catalogue des segments)
+    no_article_01 = not SegmentCatalog.load(output_dir).with_text(cls=1)
 
     if not no_article_01:
         # Étape 4 : Détection des articles incomplets
         detect_incomplete_articles(output_dir)
 
         # Étape 5 : Association articles incomplets / article_01
-        associate_articles(output_dir)
-        
+        associate_articles(output_dir, inference_url=config.get("inference_server_url"))
+
         # Étape 5.5 : Fusionner les images dans 'complete_articles'
         complete_articles_dir = output_dir / "complete_articles"
         merged_images_dir = complete_articles_dir / "merged_images"
@@ -56,34 +89,74 @@ if __name__ == "__main__":
         else:
             print("Dossier 'complete_articles' non trouvé, fusion des images ignorée.")
 
-        
+
     else:
         print("Aucun article_01 détecté, on saute la détection d'incomplets et l'association.")
 
     # Étape 6 : Nettoyer et collecter les images finales
     clean_png_files(output_dir)
     collect_final_images(output_dir)
-    
-    # Étape 7 : Export JSON
-    final_json = output_dir / "articles_final.json"
 
-    export_articles_to_json(
+    # Étape 7 : Export JSON (ou NDJSON, un article par ligne, sans tout garder en mémoire)
+    store_path = config.get("article_store_path")  # base SQLite FTS5 alimentée au fil des éditions
+    export_kwargs = dict(
         complete_dir=output_dir / "complete_articles",  # peut ne pas exister, la fonction gère
-        ocr_dir=output_text_dir,
-        incomplets_dir=output_dir / "incomplets",       # peut ne pas exister, la fonction gère
-        output_json_path=final_json
+        store_path=store_path,
+    )
+    legality_kwargs = dict(
+        model_dir=Path("../models/legal_classifier_roberta_ADA"),
+        cascade_path=config.get("legality_cascade_path"),
+        cascade_low=float(config.get("legality_cascade_low", 0.1)),
+        cascade_high=float(config.get("legality_cascade_high", 0.9)),
+        cascade_audit_rate=float(config.get("legality_cascade_audit_rate", 0.05)),
+        inference_url=config.get("inference_server_url"),
+        segment_cache_path=config.get("segment_cache_path")
+    )
+    category_kwargs = dict(
+        model_dir=Path("../models/roberta_multiclass_classifier"),
+        inference_url=config.get("inference_server_url"),
+        segment_cache_path=config.get("segment_cache_path")
     )
+    if config.get("export_format", "json") == "ndjson":
+        # Étapes 8 et 9 pendant l'export : chaque ligne est écrite déjà classifiée
+        final_json = output_dir / "articles_final.ndjson"
+        classify_legality, report = legality_classifier(output_dir, **legality_kwargs)
+        classify_category = category_classifier(output_dir, **category_kwargs)
+        export_articles_to_ndjson(output_ndjson_path=final_json, classifiers=(classify_legality, classify_category),
+                                  **export_kwargs)
+        report()
+        return
 
+    final_json = output_dir / "articles_final.json"
+    export_articles_to_json(output_json_path=final_json, **export_kwargs)
 
     # Étape 8 : Classification légalité
-    classify_articles(
-        json_path=final_json,
-        model_dir=Path("../models/legal_classifier_roberta_ADA")
-    )
+    classify_articles(json_path=final_json, store_path=store_path, **legality_kwargs)
     # Étape 9 : Classification catégories
-    classify_categories(
-        json_path=final_json,
+    classify_categories(json_path=final_json, store_path=store_path, **category_kwargs)
 
-        model_dir=Path("../models/roberta_multiclass_classifier")
-    )
-    
\ No newline at end of file
+
+if __name__ == "__main__":
+    # === Configuration utilisateur ===
+    with open("../config/config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+    pdf_path = config["pdf_path"]
+    nom_journal = config["nom_journal"]
+    output_root = config["output_root"]
+
+
+    # Étape 1 : Convertir PDF en images
+    output_dir = convert_pdf_to_images(pdf_path, nom_journal, output_root, config, dpi=config.get("detect_dpi"))
+    if output_dir is None:
+        print(f"Échec lors de la conversion du PDF {pdf_path}. Vérifiez le fichier ou les dépendances.")
+        exit(1)
+    output_dir = Path(output_dir)  # Convert to Path only if successful
+
+    # Étape 2 : Passer les images sur YOLOv8
+    run_segmentation(output_dir, pdf_path, config)
+
+    # Étape 3 : Segments → OCR
+    run_ocr(output_dir, pdf_path, config)
+
+    # Étapes 4 à 9
+    finalize_edition(output_dir, config)
@@ -5,6 +5,10 @@ from google.cloud import vision
 from pathlib import Path
 import logging
 from concurrent.futures import ThreadPoolExecutor
+import cv2
+from segment_cache import SegmentCache, phash, thumbnail, write_segment_ids
+from segment_catalog import SegmentCatalog, OCR_DONE, NO_TEXT
+from ocr_layout import OcrLayoutWriter, words_from_response
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +24,15 @@ client = vision.ImageAnnotatorClient()
 
 def extract_text_from_image(image_path: Path, language_hints: list = None) -> str:
     """Extract text from an image using Google Cloud Vision."""
+    return extract_text_and_layout(image_path, language_hints)[0]
+
+def extract_text_and_layout(image_path: Path, language_hints: list = None) -> tuple:
+    """Extract (text, words) from an image using Google Cloud Vision.
+
+    words: one tuple per word with its box, confidence, block, paragraph and
+    line (see ocr_layout.words_from_response), so the layout is kept and
+    never needs another Vision call.
+    """
     if language_hints is None:
         language_hints = config.get("ocr_language_hints", ["ar", "fr"])
     try:
@@ -29,30 +42,82 @@ def extract_text_from_image(image_path: Path, language_hints: list = None) -> st
         response = client.document_text_detection(image=image, image_context={"language_hints": language_hints})
         if response.error.message:
             logger.error(f"Vision API error for {image_path}: {response.error.message}")
-            return ""
-        return response.full_text_annotation.text
+            return "", []
+        return response.full_text_annotation.text, words_from_response(response)
     except Exception as e:
         logger.error(f"OCR failed for {image_path}: {e}")
-        return ""
+        return "", []
 
-def apply_ocr_to_segmented_images(segment_dir: Path, output_text_dir: Path, language_hints: list = None):
-    """Apply OCR to all images in segment_dir and save results."""
+def apply_ocr_to_segmented_images(segment_dir: Path, output_text_dir: Path, language_hints: list = None,
+                                  skip_stems: set = None, pages: set = None,
+                                  cache_path: Path = None, cache_max_distance: int = 3, source: str = None,
+                                  cache_max_thumb_diff: float = 0.01):
+    """Apply OCR to the segments listed in the segment catalog and save results.
+
+    pages restricts the run to these page numbers. Segments whose stem is in
+    skip_stems already have their text (e.g. from the PDF text layer) and are
+    not sent to Vision. With cache_path, segments that match a past segment by
+    perceptual hash, and are confirmed by size and thumbnail, reuse its OCR text. The catalog records where each text was
+    written, so later stages no longer scan ocr_text/. Word boxes, confidences
+    and lines of the Vision responses are saved in ocr_layout/ (see ocr_layout).
+    """
     from utils import ensure_dir
     output_text_dir = ensure_dir(output_text_dir)
-    image_files = list(segment_dir.glob("*.png"))
+    edition_dir = Path(segment_dir).parent
+    records = [r for r in SegmentCatalog.load(edition_dir) if pages is None or r.page in pages]
+    image_files = [segment_dir / f"{r.name}.png" for r in records if not skip_stems or r.name not in skip_stems]
+
+    cache = (SegmentCache(cache_path, cache_max_distance, max_thumb_diff=cache_max_thumb_diff)
+             if cache_path else None)
+    cache_entries = {}
+    layout = OcrLayoutWriter(edition_dir)
 
     def process_image(image_file):
-        logger.info(f"Processing OCR for {image_file.name}")
-        text = extract_text_from_image(image_file, language_hints)
+        text, h = None, None
+        if cache is not None:
+            image = cv2.imread(str(image_file))
+            if image is not None:
+                h, thumb, (height, width) = phash(image), thumbnail(image), image.shape[:2]
+                row = cache.lookup(h, width, height, thumb)
+                if row is not None:
+                    text = row["text"]
+                    layout.discard(image_file.stem)
+                    cache_entries[image_file.stem] = {"id": row["id"], "reused": True}
+                    logger.info(f"Segment cache hit for {image_file.name} (entry {row['id']})")
+
+        if text is None:
+            logger.info(f"Processing OCR for {image_file.name}")
+            text, words = extract_text_and_layout(image_file, language_hints)
+            layout.add(image_file.stem, words)
+            if h is not None and text.strip():
+                entry_id = cache.add(h, width, height, text, thumb, source)
+                cache_entries[image_file.stem] = {"id": entry_id, "reused": False}
+
         if text.strip():
             output_file = output_text_dir / f"{image_file.stem}.txt"
             with output_file.open("w", encoding="utf-8") as f:
                 f.write(text)
             logger.info(f"Saved OCR result: {output_file}")
-        else:
-            logger.warning(f"No text extracted from {image_file.name}")
+            return image_file.stem, True
+        logger.warning(f"No text extracted from {image_file.name}")
+        return image_file.stem, False
 
     with ThreadPoolExecutor(max_workers=4) as executor:
-        executor.map(process_image, image_files)
+        results = list(executor.map(process_image, image_files))
+    layout.close()
+
+    with SegmentCatalog.edit(edition_dir) as catalog:
+        for stem, has_text in results:
+            if has_text:
+                catalog.update(stem, text_path=f"{output_text_dir.name}/{stem}.txt", status=OCR_DONE)
+            else:
+                catalog.update(stem, text_path=None, status=NO_TEXT)
+
+    if cache is not None:
+        cache.close()
+        write_segment_ids(output_text_dir, cache_entries)
+        reused = sum(1 for e in cache_entries.values() if e["reused"])
+        logger.info(f"Segment cache: {reused}/{len(image_files)} segments served from cache, "
+                    f"{len(image_files) - reused} sent to Vision")
 
-    logger.info(f"OCR completed: {output_text_dir}")
\ No newline at end of file
+    logger.info(f"OCR completed: {output_text_dir}")
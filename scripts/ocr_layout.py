@@ -0,0 +1,245 @@
+import json
+import threading
+import uuid
+import shutil
+import logging
+from pathlib import Path
+
+import numpy as np
+
+from utils import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Mise en page OCR d'une édition : mots Vision avec boîte, confiance, bloc,
+# paragraphe, ligne et type de séparation, stockés en colonnes numpy dans
+# ocr_layout/. Les étapes suivantes (référence en dernière ligne, traits de
+# mise en page) lisent les lignes sans re-découper le texte et sans rappeler
+# Vision.
+#
+# Un appel OCR écrit un shard (ocr_layout/<id>/) :
+#   boxes.npy (N, 4) int32      x1, y1, x2, y2 du mot dans le segment
+#   conf.npy (N,) float32       confiance Vision
+#   block.npy, para.npy, line.npy (N,) int32   indices dans le segment
+#   brk.npy (N,) int8           séparation après le mot (BREAK_*)
+#   text_offsets.npy (N+1,) int64 + text.bin   texte UTF-8 des mots
+#   segments.json               {segment: [premier mot, dernier mot + 1]}
+# ocr_layout/index.json associe chaque segment à son shard le plus récent.
+# Un segment dont le texte vient ensuite d'une autre source (couche texte PDF,
+# cache pHash) est retiré de l'index : sa mise en page ne correspondrait plus
+# au texte de ocr_text/.
+#
+# Réduction volontaire de la réponse Vision : seuls les mots sont stockés.
+# Les boîtes des blocs et paragraphes sont l'union des boîtes de leurs mots
+# (OcrLayout.region_boxes) ; les symboles (boîte et confiance par caractère,
+# environ 5 fois plus volumineux) ne sont pas conservés.
+LAYOUT_DIR = "ocr_layout"
+INDEX_FILE = "index.json"
+
+# detected_break.type de Vision
+BREAK_NONE, BREAK_SPACE, BREAK_SURE_SPACE, BREAK_EOL_SURE_SPACE, BREAK_HYPHEN, BREAK_LINE = range(6)
+END_OF_LINE = (BREAK_EOL_SURE_SPACE, BREAK_HYPHEN, BREAK_LINE)
+
+
+def words_from_response(response) -> list:
+    """Mots de full_text_annotation : (texte, x1, y1, x2, y2, confiance, bloc, paragraphe, ligne, séparation)."""
+    words = []
+    block_idx = para_idx = line = 0
+    for page in response.full_text_annotation.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    if not word.symbols:
+                        continue
+                    xs = [v.x for v in word.bounding_box.vertices]
+                    ys = [v.y for v in word.bounding_box.vertices]
+                    brk = int(word.symbols[-1].property.detected_break.type_)
+                    text = "".join(s.text for s in word.symbols)
+                    words.append((text, min(xs), min(ys), max(xs), max(ys), word.confidence,
+                                  block_idx, para_idx, line, brk))
+                    if brk in END_OF_LINE:
+                        line += 1
+                if words and words[-1][8] == line:
+                    line += 1  # un paragraphe se termine toujours en fin de ligne
+                para_idx += 1
+            block_idx += 1
+    return words
+
+
+class OcrLayoutWriter:
+    """Collecte les mots des segments d'un appel OCR (threads) puis écrit un shard."""
+
+    def __init__(self, edition_dir: Path):
+        self.layout_dir = Path(edition_dir) / LAYOUT_DIR
+        self.words = {}
+        self.discarded = set()
+        self.lock = threading.Lock()
+
+    def add(self, segment: str, words: list):
+        with self.lock:
+            self.words[segment] = words
+
+    def discard(self, segment: str):
+        """Le texte du segment ne vient pas de Vision : sa mise en page précédente est retirée."""
+        with self.lock:
+            self.discarded.add(segment)
+
+    def close(self):
+        if not self.words:
+            if self.discarded:
+                drop_segments(self.layout_dir.parent, self.discarded)
+            return
+        shard = uuid.uuid4().hex[:12]
+        shard_dir = self.layout_dir / shard
+        shard_dir.mkdir(parents=True, exist_ok=True)
+
+        ranges, rows = {}, []
+        for segment in sorted(self.words):
+            ranges[segment] = [len(rows), len(rows) + len(self.words[segment])]
+            rows += self.words[segment]
+
+        encoded = [w[0].encode("utf-8") for w in rows]
+        np.save(shard_dir / "boxes.npy", np.array([w[1:5] for w in rows], dtype=np.int32).reshape(-1, 4))
+        np.save(shard_dir / "conf.npy", np.array([w[5] for w in rows], dtype=np.float32))
+        for name, col in (("block", 6), ("para", 7), ("line", 8)):
+            np.save(shard_dir / f"{name}.npy", np.array([w[col] for w in rows], dtype=np.int32))
+        np.save(shard_dir / "brk.npy", np.array([w[9] for w in rows], dtype=np.int8))
+        np.save(shard_dir / "text_offsets.npy", np.concatenate([[0], np.cumsum([len(e) for e in encoded])]).astype(np.int64))
+        (shard_dir / "text.bin").write_bytes(b"".join(encoded))
+        (shard_dir / "segments.json").write_text(json.dumps(ranges, ensure_ascii=False), encoding="utf-8")
+
+        _update_index(self.layout_dir, {segment: shard for segment in ranges}, self.discarded)
+        logger.info(f"OCR layout: {len(rows)} words of {len(ranges)} segments saved in {shard_dir}")
+
+
+def drop_segments(edition_dir: Path, segments):
+    """Retire de l'index les segments dont le texte vient d'une autre source que Vision."""
+    layout_dir = Path(edition_dir) / LAYOUT_DIR
+    if segments and (layout_dir / INDEX_FILE).exists():
+        _update_index(layout_dir, {}, set(segments))
+
+
+def _update_index(layout_dir: Path, added: dict, removed: set):
+    # Plusieurs workers OCR peuvent écrire des pages différentes de la même édition
+    layout_dir.mkdir(parents=True, exist_ok=True)
+    index_path = layout_dir / INDEX_FILE
+    with file_lock(index_path):
+        index = _read_index(layout_dir)
+        previous = set(index.values())
+        for segment in removed:
+            index.pop(segment, None)
+        index.update(added)
+        tmp_path = index_path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(index, ensure_ascii=False), encoding="utf-8")
+        tmp_path.replace(index_path)
+        # Shards dont plus aucun segment n'est référencé
+        for old in previous - set(index.values()):
+            shutil.rmtree(layout_dir / old, ignore_errors=True)
+
+
+def _read_index(layout_dir: Path) -> dict:
+    path = layout_dir / INDEX_FILE
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+
+
+class _Shard:
+    def __init__(self, shard_dir: Path):
+        self.boxes = np.load(shard_dir / "boxes.npy", mmap_mode="r")
+        self.conf = np.load(shard_dir / "conf.npy", mmap_mode="r")
+        self.block = np.load(shard_dir / "block.npy", mmap_mode="r")
+        self.para = np.load(shard_dir / "para.npy", mmap_mode="r")
+        self.line = np.load(shard_dir / "line.npy", mmap_mode="r")
+        self.brk = np.load(shard_dir / "brk.npy", mmap_mode="r")
+        self.offsets = np.load(shard_dir / "text_offsets.npy", mmap_mode="r")
+        size = int(self.offsets[-1]) if len(self.offsets) else 0
+        self.text = np.memmap(shard_dir / "text.bin", dtype=np.uint8, mode="r") if size else np.empty(0, np.uint8)
+        self.ranges = json.loads((shard_dir / "segments.json").read_text(encoding="utf-8"))
+
+    def word_text(self, i: int) -> str:
+        return self.text[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def join_lines(self, start: int, end: int) -> list:
+        """Texte des lignes des mots start..end-1, espaces et traits d'union rétablis."""
+        lines, current, line = [], [], None
+        for i in range(start, end):
+            if line is not None and self.line[i] != line:
+                lines.append("".join(current).strip())
+                current = []
+            line = self.line[i]
+            current.append(self.word_text(i))
+            brk = self.brk[i]
+            if brk in (BREAK_SPACE, BREAK_SURE_SPACE):
+                current.append(" ")
+            elif brk == BREAK_HYPHEN:
+                current.append("-")
+        if current:
+            lines.append("".join(current).strip())
+        return [l for l in lines if l]
+
+
+class OcrLayout:
+    """Lecture de ocr_layout/ d'une édition (tableaux mappés en mémoire, shards chargés à la demande)."""
+
+    def __init__(self, edition_dir: Path):
+        self.layout_dir = Path(edition_dir) / LAYOUT_DIR
+        self.index = _read_index(self.layout_dir)
+        self._shards = {}
+
+    def __contains__(self, segment: str) -> bool:
+        return segment in self.index
+
+    def _locate(self, segment: str):
+        shard_id = self.index.get(segment)
+        if shard_id is None:
+            return None, 0, 0
+        if shard_id not in self._shards:
+            self._shards[shard_id] = _Shard(self.layout_dir / shard_id)
+        shard = self._shards[shard_id]
+        start, end = shard.ranges[segment]
+        return shard, start, end
+
+    def words(self, segment: str):
+        """Colonnes des mots du segment (vues numpy) et leurs textes, ou None si absent."""
+        shard, start, end = self._locate(segment)
+        if shard is None:
+            return None
+        return {
+            "text": [shard.word_text(i) for i in range(start, end)],
+            "box": shard.boxes[start:end],
+            "conf": shard.conf[start:end],
+            "block": shard.block[start:end],
+            "para": shard.para[start:end],
+            "line": shard.line[start:end],
+        }
+
+    def lines(self, segment: str):
+        """Lignes du segment dans l'ordre de lecture Vision, ou None si absent."""
+        shard, start, end = self._locate(segment)
+        if shard is None:
+            return None
+        return shard.join_lines(start, end)
+
+    def last_line(self, segment: str):
+        """Dernière ligne non vide du segment, ou None si absent."""
+        shard, start, end = self._locate(segment)
+        if shard is None or start == end:
+            return None
+        # Seuls les mots de la dernière ligne sont décodés
+        first = int(np.searchsorted(shard.line[start:end], shard.line[end - 1])) + start
+        lines = shard.join_lines(first, end) or shard.join_lines(start, end)
+        return lines[-1] if lines else None
+
+    def region_boxes(self, segment: str, level: str = "para"):
+        """{indice de bloc ou de paragraphe: (x1, y1, x2, y2)}, union des boîtes de ses mots, ou None si absent."""
+        shard, start, end = self._locate(segment)
+        if shard is None:
+            return None
+        ids, boxes = getattr(shard, level)[start:end], shard.boxes[start:end]
+        return {int(i): tuple(int(v) for v in (*boxes[ids == i, :2].min(axis=0), *boxes[ids == i, 2:].max(axis=0)))
+                for i in np.unique(ids)}
+
+    def mean_confidence(self, segment: str):
+        shard, start, end = self._locate(segment)
+        if shard is None or start == end:
+            return None
+        return float(np.mean(shard.conf[start:end]))
@@ -4,6 +4,9 @@ from pathlib import Path
 from transformers import pipeline
 from langdetect import detect, DetectorFactory
 from tqdm import tqdm
+from inference_client import RemoteClassifier
+from segment_cache import cached_labels, record_labels
+from export_articles_to_json import update_ndjson_articles, update_store_classification, CLASSIFY_BATCH_SIZE
 
 DetectorFactory.seed = 0  # stabilité langdetect
 
@@ -82,28 +85,54 @@ category_mapping = {
 # === Pipeline global pour éviter rechargement
 classifier = None
 
-def classify_categories(json_path: Path, model_dir: Path):
+def category_classifier(edition_dir: Path, model_dir: Path, inference_url: str = None,
+                        segment_cache_path: Path = None):
+    """Classifieur de catégories des articles d'une édition : classify_batch.
+
+    classify_batch(articles) renseigne cat sur les articles légaux d'un lot
+    (is_legal doit déjà être connu).
+    """
     global classifier
-    if classifier is None:
+    if inference_url:
+        # Serveur d'inférence : le modèle reste chargé côté serveur
+        classifier = RemoteClassifier(inference_url, "category")
+    elif classifier is None or isinstance(classifier, RemoteClassifier):
         classifier = pipeline("text-classification", model=str(model_dir), tokenizer=str(model_dir))
 
-    with json_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)  # Load the full JSON object
-        articles = data.get("articles", [])  # Access the articles list
-
-    for article in tqdm(articles, desc="📊 Prédiction des catégories"):
-        if not article.get("is_legal", False):
-            continue
-
-        text = preprocess_text(article.get("articleText", ""))
-        if not text:
-            article["cat"] = []
-            continue
-
+    # Segments réutilisés depuis le cache pHash : catégorie déjà connue
+    ocr_dir = Path(edition_dir) / "ocr_text"
+    reused = cached_labels(segment_cache_path, ocr_dir, "cat") if segment_cache_path else {}
+
+    def label_batch(articles):
+        """Prédit les catégories des articles légaux d'un lot en un seul appel au classifieur."""
+        pending = []
+        for article in articles:
+            if not article.get("is_legal", False):
+                continue
+
+            stem = Path(article["file"]).stem
+            if stem in reused:
+                article["cat"] = reused[stem]
+                continue
+
+            text = preprocess_text(article.get("articleText", ""))
+            if not text:
+                article["cat"] = []
+                continue
+            pending.append((article, text))
+
+        if not pending:
+            return
         try:
-            result = classifier(text, truncation=True, max_length=512)[0]
-            label = result["label"]
-            mapped = category_mapping.get(label, category_mapping["Divers"])
+            results = classifier([text for _, text in pending], truncation=True, max_length=512)
+        except Exception as e:
+            print(f"❌ Erreur pour un lot de {len(pending)} articles → {e}")
+            for article, _ in pending:
+                article["cat"] = []
+            return
+
+        for (article, _), result in zip(pending, results):
+            mapped = category_mapping.get(result["label"], category_mapping["Divers"])
 
             article["cat"] = [{
                 "slug": mapped["slug"],
@@ -113,11 +142,39 @@ def classify_categories(json_path: Path, model_dir: Path):
                 }
             }]
 
-        except Exception as e:
-            print(f"❌ Erreur pour article: {article.get('title', '')} → {e}")
-            article["cat"] = []
+    def classify_batch(articles):
+        label_batch(articles)
+        if segment_cache_path:
+            record_labels(segment_cache_path, ocr_dir, articles, "cat")
+
+    return classify_batch
+
+
+def classify_categories(json_path: Path, model_dir: Path, inference_url: str = None, store_path: Path = None,
+                        segment_cache_path: Path = None):
+    """Ajoute cat aux articles légaux d'un fichier articles_final déjà exporté (.json ou .ndjson)."""
+    classify_batch = category_classifier(json_path.parent, model_dir, inference_url, segment_cache_path)
+
+    # Mode NDJSON : prédiction par lots d'articles, sans charger le fichier
+    if json_path.suffix == ".ndjson":
+        update_ndjson_articles(json_path, classify_batch, store_path, desc="📊 Prédiction des catégories")
+        print(f"\n✅ Fichier mis à jour avec champ 'cat' dans : {json_path}")
+        return
+
+    with json_path.open("r", encoding="utf-8") as f:
+        data = json.load(f)  # Load the full JSON object
+        articles = data.get("articles", [])  # Access the articles list
+
+    with tqdm(total=len(articles), desc="📊 Prédiction des catégories") as progress:
+        for start in range(0, len(articles), CLASSIFY_BATCH_SIZE):
+            batch = articles[start:start + CLASSIFY_BATCH_SIZE]
+            classify_batch(batch)
+            progress.update(len(batch))
 
     with json_path.open("w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=4)  # Write back the full object
 
-    print(f"\n✅ Fichier mis à jour avec champ 'cat' dans : {json_path}")
\ No newline at end of file
+    if store_path:
+        update_store_classification(store_path, articles)
+
+    print(f"\n✅ Fichier mis à jour avec champ 'cat' dans : {json_path}")
@@ -1,10 +1,22 @@
 # scripts/predict_legality.py
 import json
+import math
 import re
+import zlib
+from collections import Counter
 from pathlib import Path
 from langdetect import detect
 from transformers import pipeline
 from tqdm import tqdm
+import joblib
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import make_pipeline
+from inference_client import RemoteClassifier
+from segment_cache import cached_labels, record_labels
+from export_articles_to_json import update_ndjson_articles, iter_ndjson_records, update_store_classification, \
+    CLASSIFY_BATCH_SIZE
 
 
 def normalize_arabic(text):
@@ -37,28 +49,200 @@ def preprocess_text(text):
     return cleaned_text
 
 
-def classify_articles(json_path: Path, model_dir: Path):
+def load_articles(json_path: Path) -> list:
+    """Articles d'un fichier articles_final (.json ou .ndjson)."""
+    if json_path.suffix == ".ndjson":
+        return [r for r in iter_ndjson_records(json_path) if r.get("record") == "article"]
     with json_path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
+        return json.load(f).get("articles", [])
 
-    articles = data.get("articles", [])
 
+# === Cascade : pré-classifieur rapide devant RoBERTa ===
+# TF-IDF sur n-grammes de caractères + régression logistique, entraîné sur les
+# étiquettes produites par le modèle RoBERTa lui-même. Les articles dont la
+# probabilité est hors de la bande [low, high] sont décidés directement ;
+# seuls les cas incertains passent par le transformer.
+
+def train_legality_cascade(json_paths: list, model_dir: Path, output_path: Path, test_size: float = 0.2):
+    """Entraîne le pré-classifieur à partir d'éditions déjà exportées et l'enregistre dans output_path."""
     classifier = pipeline("text-classification", model=str(model_dir), tokenizer=str(model_dir))
 
-    for article in tqdm(articles, desc="🔍 Classification des articles"):
-        text = preprocess_text(article["articleText"])
-        if not text:
-            article["is_legal"] = False
-            continue
+    texts, labels = [], []
+    for json_path in json_paths:
+        for article in tqdm(load_articles(Path(json_path)), desc=f"🏷️ Étiquetage {Path(json_path).parent.name}"):
+            text = preprocess_text(article["articleText"])
+            if not text:
+                continue
+            texts.append(text)
+            labels.append(classifier(text, truncation=True)[0]["label"] == "Positive")
+
+    if len(set(labels)) < 2:
+        print("❌ Pas assez d'exemples des deux classes pour entraîner le pré-classifieur.")
+        return None
+
+    def build_model():
+        return make_pipeline(
+            TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4), sublinear_tf=True, max_features=200000),
+            LogisticRegression(max_iter=1000, class_weight="balanced"),
+        )
+
+    # Stratification impossible si une classe a moins de 2 exemples ou si le jeu de test
+    # est plus petit que le nombre de classes (petites éditions, presque pas d'articles légaux)
+    n_test = math.ceil(len(texts) * test_size)
+    stratify = labels if min(Counter(labels).values()) >= 2 and 2 <= n_test <= len(texts) - 2 else None
+    if stratify is None:
+        print(f"⚠️ Classes trop déséquilibrées ({Counter(labels)[True]} légaux / {Counter(labels)[False]} non légaux) "
+              f"pour un découpage stratifié : découpage aléatoire simple.")
+    X_train, X_test, y_train, y_test = train_test_split(texts, labels, test_size=test_size,
+                                                        stratify=stratify, random_state=0)
+    if len(set(y_train)) < 2:
+        print("❌ Le jeu d'entraînement ne contient qu'une seule classe : ajoutez des éditions.")
+        return None
+    model = build_model().fit(X_train, y_train)
+    agreement = model.score(X_test, y_test)
+
+    # Modèle final sur toutes les étiquettes
+    model = build_model().fit(texts, labels)
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump(model, output_path)
+    print(f"✅ Pré-classifieur enregistré : {output_path} ({len(texts)} articles, "
+          f"accord avec RoBERTa sur le jeu de test : {agreement:.1%})")
+    return model
+
+
+def legality_classifier(edition_dir: Path, model_dir: Path, cascade_path: Path = None,
+                        cascade_low: float = 0.1, cascade_high: float = 0.9, inference_url: str = None,
+                        segment_cache_path: Path = None, cascade_audit_rate: float = 0.05):
+    """Classifieur de légalité des articles d'une édition : (classify_batch, report).
+
+    classify_batch(articles) renseigne is_legal sur un lot d'articles ; report()
+    affiche les statistiques du cache de segments et de la cascade.
+    """
+    # cascade_audit_rate : part des articles décidés par le pré-classifieur qui passent aussi
+    # par RoBERTa, pour mesurer l'accord hors zone incertaine et valider les seuils.
+    # L'étiquette reste celle du pré-classifieur.
+    # Serveur d'inférence : le modèle reste chargé côté serveur
+    classifier = RemoteClassifier(inference_url, "legality") if inference_url else None
+    cascade = None
+    if cascade_path:
+        if Path(cascade_path).exists():
+            cascade = joblib.load(cascade_path)
+        else:
+            print(f"⚠️ Pré-classifieur introuvable : {cascade_path} → RoBERTa sur tous les articles")
+
+    stats = {"articles": 0, "routed": 0, "agree": 0, "from_cache": 0, "audited": 0, "audit_agree": 0}
+
+    # Segments réutilisés depuis le cache pHash : étiquette déjà connue
+    ocr_dir = Path(edition_dir) / "ocr_text"
+    reused = cached_labels(segment_cache_path, ocr_dir, "is_legal") if segment_cache_path else {}
+
+    def roberta_labels(texts):
+        """Étiquettes RoBERTa d'un lot de textes (une seule requête avec le serveur d'inférence)."""
+        nonlocal classifier
+        if classifier is None:
+            classifier = pipeline("text-classification", model=str(model_dir), tokenizer=str(model_dir))
+        return [r["label"] == "Positive" for r in classifier(texts, truncation=True)]
+
+    def audited(stem):
+        # Échantillon déterministe (même article → même décision d'une exécution à l'autre)
+        return zlib.crc32(stem.encode("utf-8")) % 10000 < cascade_audit_rate * 10000
+
+    def label_batch(articles):
+        """Classe un lot d'articles : pré-classifieur puis un seul appel RoBERTa pour tout le lot."""
+        pending = []
+        for article in articles:
+            stem = Path(article["file"]).stem
+            if stem in reused:
+                article["is_legal"] = reused[stem]
+                stats["from_cache"] += 1
+                continue
+            text = preprocess_text(article["articleText"])
+            if not text:
+                article["is_legal"] = False
+                continue
+            stats["articles"] += 1
+            pending.append((article, text))
+
+        probas = cascade.predict_proba([t for _, t in pending])[:, 1] if cascade is not None and pending else None
+        routed, audit = [], []
+        for i, (article, text) in enumerate(pending):
+            proba = probas[i] if probas is not None else None
+            if proba is not None and (proba <= cascade_low or proba >= cascade_high):
+                article["is_legal"] = bool(proba >= cascade_high)
+                if cascade_audit_rate and audited(Path(article["file"]).stem):
+                    audit.append((article, text, proba))
+                continue
+            if proba is not None:
+                stats["routed"] += 1
+            routed.append((article, text, proba))
+
+        queries = routed + audit
+        if not queries:
+            return
         try:
-            result = classifier(text, truncation=True)[0]
-            label = result["label"]
-            article["is_legal"] = label == "Positive"
+            labels = roberta_labels([text for _, text, _ in queries])
         except Exception as e:
-            print(f"❌ Erreur pour article: {article['title']} → {e}")
-            article["is_legal"] = False
+            print(f"❌ Erreur RoBERTa pour un lot de {len(queries)} articles → {e}")
+            labels = [None] * len(queries)
+        for (article, _, proba), label in zip(routed, labels):
+            article["is_legal"] = bool(label)
+            if label is not None and proba is not None and (proba >= 0.5) == label:
+                stats["agree"] += 1
+        for (article, _, _), label in zip(audit, labels[len(routed):]):
+            if label is not None:
+                stats["audit_agree"] += label == article["is_legal"]
+                stats["audited"] += 1
+
+    def classify_batch(articles):
+        label_batch(articles)
+        if segment_cache_path:
+            record_labels(segment_cache_path, ocr_dir, articles, "is_legal")
+
+    def report():
+        if stats["from_cache"]:
+            print(f"♻️ {stats['from_cache']} articles étiquetés depuis le cache de segments")
+        if cascade is None or not stats["articles"]:
+            return
+        routed = stats["routed"]
+        agreement = f"{stats['agree'] / routed:.1%}" if routed else "n/a"
+        print(f"📈 Cascade : {routed}/{stats['articles']} articles envoyés à RoBERTa "
+              f"({routed / stats['articles']:.1%}), accord pré-classifieur/RoBERTa sur ces articles : {agreement}")
+        if stats["audited"]:
+            print(f"🔎 Audit : accord pré-classifieur/RoBERTa sur {stats['audited']} articles décidés sans RoBERTa "
+                  f"(échantillon de {cascade_audit_rate:.0%}) : {stats['audit_agree'] / stats['audited']:.1%}")
+
+    return classify_batch, report
+
+
+def classify_articles(json_path: Path, model_dir: Path, cascade_path: Path = None,
+                      cascade_low: float = 0.1, cascade_high: float = 0.9, inference_url: str = None,
+                      store_path: Path = None, segment_cache_path: Path = None, cascade_audit_rate: float = 0.05):
+    """Ajoute is_legal aux articles d'un fichier articles_final déjà exporté (.json ou .ndjson)."""
+    classify_batch, report = legality_classifier(json_path.parent, model_dir, cascade_path, cascade_low, cascade_high,
+                                                 inference_url, segment_cache_path, cascade_audit_rate)
+
+    # Mode NDJSON : classification par lots d'articles, sans charger le fichier
+    if json_path.suffix == ".ndjson":
+        update_ndjson_articles(json_path, classify_batch, store_path, desc="🔍 Classification des articles")
+        report()
+        print(f"\n✅ Articles mis à jour avec le champ 'is_legal' dans : {json_path}")
+        return
+
+    with json_path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+
+    articles = data.get("articles", [])
+
+    with tqdm(total=len(articles), desc="🔍 Classification des articles") as progress:
+        for start in range(0, len(articles), CLASSIFY_BATCH_SIZE):
+            batch = articles[start:start + CLASSIFY_BATCH_SIZE]
+            classify_batch(batch)
+            progress.update(len(batch))
 
     with json_path.open("w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=4)
 
+    if store_path:
+        update_store_classification(store_path, articles)
+    report()
     print(f"\n✅ Articles mis à jour avec le champ 'is_legal' dans : {json_path}")
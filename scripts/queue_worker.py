@@ -0,0 +1,150 @@
+# Traitement distribué : plusieurs machines partagent la file work_queue (SQLite
+# sur stockage partagé) et le dossier output_root.
+#
+#   python queue_worker.py enqueue ../input/journal.pdf JrSahafa
+#   python queue_worker.py work          (sur chaque machine, autant de fois que voulu)
+#   python queue_worker.py status
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+from pathlib import Path
+
+import yaml
+from pdf2image import pdfinfo_from_path
+
+from convert_pdf_to_images import convert_pdf_to_images, edition_output_dir
+from main import run_segmentation, run_ocr, finalize_edition
+from work_queue import WorkQueue, FINALIZE
+
+logger = logging.getLogger(__name__)
+
+# YOLO chargé une seule fois par processus worker, réutilisé par toutes ses tâches "segment"
+_yolo_model = None
+
+
+def _segmentation_model(config: dict):
+    """Instance YOLO du worker, ou None si la détection passe par le serveur d'inférence."""
+    global _yolo_model
+    if config.get("inference_server_url"):
+        return None
+    if _yolo_model is None:
+        from ultralytics import YOLO
+        _yolo_model = YOLO(config["model_path"])
+    return _yolo_model
+
+
+def open_queue(config: dict) -> WorkQueue:
+    return WorkQueue(config.get("queue_path", "../output/queue.sqlite"),
+                     lease_seconds=int(config.get("queue_lease_seconds", 900)),
+                     max_attempts=int(config.get("queue_max_attempts", 3)))
+
+
+def enqueue_edition(queue: WorkQueue, pdf_path: str, nom_journal: str, output_root: str, date_str: str = None):
+    """Ajoute une édition à la file ; le dossier de sortie est fixé dès maintenant.
+
+    Retourne None si ce dossier de sortie est déjà dans la file.
+    """
+    num_pages = int(pdfinfo_from_path(pdf_path)["Pages"])
+    output_dir = edition_output_dir(output_root, nom_journal, date_str)
+    return queue.add_edition(pdf_path, nom_journal, output_dir, num_pages)
+
+
+def run_task(task: dict, config: dict):
+    """Exécute une tâche réclamée dans la file. Lève une exception en cas d'échec."""
+    output_dir = Path(task["output_dir"])
+    pdf_path = task["pdf_path"]
+    page = task["page"]
+    stage = task["stage"]
+    logger.info(f"Tâche {task['id']} : {stage} page {page} de {output_dir} (tentative {task['attempts']})")
+
+    if stage == "rasterize":
+        result = convert_pdf_to_images(pdf_path, task["nom_journal"], str(output_dir.parent.parent), config,
+                                       dpi=config.get("detect_dpi"), first_page=page, last_page=page,
+                                       date_str=output_dir.name)
+        if result is None:
+            raise RuntimeError(f"Conversion de la page {page} échouée")
+    elif stage == "segment":
+        run_segmentation(output_dir, pdf_path, config, pages={page}, model=_segmentation_model(config))
+    elif stage == "ocr":
+        run_ocr(output_dir, pdf_path, config, pages={page})
+    elif stage == FINALIZE:
+        finalize_edition(output_dir, config)
+    else:
+        raise ValueError(f"Étape inconnue : {stage}")
+
+
+def _keep_lease(config: dict, task_id: int, worker_id: str, stop: threading.Event):
+    """Renouvelle le bail de la tâche tant qu'elle tourne (connexion SQLite propre au thread)."""
+    queue = open_queue(config)
+    while not stop.wait(queue.lease_seconds / 3):
+        if not queue.renew(task_id, worker_id):
+            logger.warning(f"Bail perdu pour la tâche {task_id}")
+            return
+
+
+def run_worker(config: dict, worker_id: str = None, once: bool = False):
+    """Boucle du worker : réclamer, exécuter, valider ou signaler l'échec."""
+    queue = open_queue(config)
+    worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    poll_interval = float(config.get("queue_poll_interval", 5))
+    logger.info(f"Worker {worker_id} démarré")
+
+    while True:
+        task = queue.claim(worker_id)
+        if task is None:
+            if once:
+                return
+            time.sleep(poll_interval)
+            continue
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=_keep_lease, args=(config, task["id"], worker_id, stop), daemon=True)
+        heartbeat.start()
+        try:
+            run_task(task, config)
+        except Exception as e:
+            logger.exception(f"Tâche {task['id']} en échec")
+            queue.fail(task["id"], worker_id, repr(e))
+        else:
+            queue.complete(task["id"], worker_id)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open("../config/config.yaml", "r") as f:
+        config = yaml.safe_load(f)
+
+    parser = argparse.ArgumentParser(description="File de traitement distribuée des éditions")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_enqueue = sub.add_parser("enqueue", help="ajouter une édition à la file")
+    p_enqueue.add_argument("pdf_path")
+    p_enqueue.add_argument("nom_journal")
+    p_enqueue.add_argument("--date", default=None, help="YYYY-MM-DD (date du jour par défaut)")
+    p_work = sub.add_parser("work", help="lancer un worker")
+    p_work.add_argument("--once", action="store_true", help="s'arrêter quand la file est vide")
+    sub.add_parser("status", help="état des éditions")
+    args = parser.parse_args()
+
+    if args.command == "enqueue":
+        queue = open_queue(config)
+        edition_id = enqueue_edition(queue, args.pdf_path, args.nom_journal, config["output_root"], args.date)
+        if edition_id is None:
+            output_dir = edition_output_dir(config["output_root"], args.nom_journal, args.date)
+            print(f"❌ {output_dir} est déjà dans la file (édition {queue.find_edition(output_dir)}). "
+                  f"Choisissez une autre date avec --date.")
+            exit(1)
+        print(f"✅ Édition {edition_id} ajoutée à la file")
+    elif args.command == "work":
+        run_worker(config, once=args.once)
+    else:
+        queue = open_queue(config)
+        for row in queue.conn.execute("SELECT * FROM editions ORDER BY id"):
+            counts = ", ".join(f"{stage}/{status}: {n}" for (stage, status), n in
+                               sorted(queue.edition_status(row["id"]).items()))
+            print(f"[{row['id']}] {row['output_dir']} ({row['num_pages']} p.) {row['status']} — {counts}")
@@ -1,48 +1,330 @@
 from ultralytics import YOLO
 import cv2
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 from utils import ensure_dir
+from convert_pdf_to_images import render_pdf_region
+from inference_client import detect_remote
+from segment_filter import classify_segment, dump_rejected
+from segment_catalog import SegmentCatalog, SegmentRecord
+from layout_templates import LayoutTemplates
 import logging
+import re
+import tempfile
 
 logger = logging.getLogger(__name__)
 
-def segment_articles_with_yolo(image_dir: str, model_path: str, batch_size: int = 10):
+
+def _detect(model, image):
+    """Run YOLO on one page and return (boxes, classes), or None if nothing is detected."""
+    results = model(image)
+    if not results or not results[0].boxes:
+        return None
+    boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
+    classes = results[0].boxes.cls.cpu().numpy().astype(int)
+    return boxes, classes
+
+
+def _page_number(stem: str):
+    """Page number of a page image stem (<journal>_page_<n>), or None if the name does not match."""
+    m = re.search(r'_page_(\d+)$', stem)
+    return int(m.group(1)) if m else None
+
+
+def _open_templates(layout_templates: dict):
+    """LayoutTemplates for the config "layout_templates" section, or None when not given."""
+    return LayoutTemplates(layout_templates["path"], layout_templates) if layout_templates else None
+
+
+def _match_template(templates, journal: str, stem: str, image):
+    """Boxes of the stored layout template of this page if it still fits, else None (run YOLO)."""
+    if templates is None or image is None:
+        return None
+    return templates.match(journal, _page_number(stem), image)
+
+
+def _render_region(pdf_path: str, page_num: int, box, dpi: int):
+    """Render one region of a PDF page at dpi (BGR array), or None on failure."""
+    with tempfile.TemporaryDirectory() as tmp:
+        region_path = Path(tmp) / "region.png"
+        if not render_pdf_region(pdf_path, page_num, box, dpi, region_path):
+            return None
+        return cv2.imread(str(region_path))
+
+
+def _save_segments(image, boxes, classes, stem: str, output_segment_dir: Path,
+                   pdf_path: str = None, detect_dpi: int = None, crop_dpi: int = None,
+                   segment_filter: dict = None):
+    """Crop every detected box out of the page and save it as a PNG segment.
+
+    With pdf_path, `image` is a low-DPI page used for detection only: the
+    union of the kept boxes, scaled to crop_dpi, is rendered from the PDF in
+    one pdftoppm call and every segment is cropped from that region. Pages
+    where no box is kept are not rendered again.
+    With segment_filter (config "segment_filter" section), crops that look like
+    photos, logos or empty regions are dropped so they never reach OCR. The
+    filter runs on the detection image, before any high-DPI rendering.
+    article_01 segments (continuations, often short) are never filtered: the
+    association of incomplete articles needs all of them.
+    Returns one SegmentRecord per saved segment.
+    """
+    records = []
+    rejected = 0
+    page_num = _page_number(stem)
+    page_height, page_width = image.shape[:2]
+    kept = []
+    for idx, ((x1, y1, x2, y2), cls) in enumerate(zip(boxes, classes)):
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(page_width, int(x2)), min(page_height, int(y2))
+        segment_filename = f"{stem}_article_{cls:02d}_{idx+1}.png"
+        segment = image[y1:y2, x1:x2]
+        if not segment.size:
+            logger.warning(f"Empty crop for {segment_filename}, skipped")
+            continue
+
+        if segment_filter and cls != 1:
+            is_text, reason, features = classify_segment(segment, segment_filter)
+            if not is_text:
+                rejected += 1
+                if segment_filter.get("debug_dump"):
+                    dump_rejected(output_segment_dir.parent, Path(segment_filename).stem, segment, reason, features)
+                logger.info(f"Skipped non-text segment: {segment_filename} ({reason})")
+                continue
+        kept.append((idx, cls, (x1, y1, x2, y2), segment))
+    if rejected:
+        logger.info(f"{stem}: {rejected} non-text segments skipped before OCR")
+
+    if pdf_path and kept:
+        scale = crop_dpi / detect_dpi
+        union = (min(b[0] for _, _, b, _ in kept), min(b[1] for _, _, b, _ in kept),
+                 max(b[2] for _, _, b, _ in kept), max(b[3] for _, _, b, _ in kept))
+        ux1, uy1, ux2, uy2 = (int(round(v * scale)) for v in union)
+        region = _render_region(pdf_path, page_num, (ux1, uy1, ux2, uy2), crop_dpi)
+        if region is None:
+            return records
+        kept = [(idx, cls, box, region[int(round(box[1] * scale)) - uy1:int(round(box[3] * scale)) - uy1,
+                                       int(round(box[0] * scale)) - ux1:int(round(box[2] * scale)) - ux1])
+                for idx, cls, box, _ in kept]
+
+    for idx, cls, (x1, y1, x2, y2), segment in kept:
+        segment_path = output_segment_dir / f"{stem}_article_{cls:02d}_{idx+1}.png"
+        if not segment.size:
+            logger.warning(f"Empty crop for {segment_path.name}, skipped")
+            continue
+        cv2.imwrite(str(segment_path), segment)
+        logger.info(f"Saved segment: {segment_path.name}")
+        records.append(SegmentRecord(segment_path.stem, page_num, int(cls), idx + 1,
+                                     x1, y1, x2, y2, page_width, page_height))
+    return records
+
+
+def _write_catalog(image_dir: Path, records: list, pages: set):
+    """Replace the catalog records of `pages` with `records`, keeping the other pages.
+
+    Several workers may segment different pages of the same edition, hence
+    the locked read-modify-write (SegmentCatalog.edit).
+    """
+    with SegmentCatalog.edit(image_dir) as catalog:
+        catalog.replace_pages(pages, records)
+    logger.info(f"Segment catalog updated: {len(records)} segments on {len(pages)} pages")
+
+
+def _page_images(image_dir: Path, pages=None) -> list:
+    image_files = []
+    for file in sorted(image_dir.glob("*.png")):
+        if _page_number(file.stem) is None:
+            # e.g. final segment images copied next to the pages; cropping them as page 1 would be wrong
+            logger.warning(f"Not a page image (no _page_<n> suffix), skipped: {file.name}")
+            continue
+        image_files.append(file)
+    if pages is not None:
+        image_files = [f for f in image_files if _page_number(f.stem) in pages]
+    return image_files
+
+
+def segment_articles_with_yolo(image_dir: str, model_path: str, batch_size: int = 10,
+                               pdf_path: str = None, detect_dpi: int = None, crop_dpi: int = None,
+                               pages: set = None, inference_url: str = None, segment_filter: dict = None,
+                               layout_templates: dict = None, model=None):
+    """Run YOLO on every page image of image_dir and save the detected segments.
+
+    Two-resolution mode: when pdf_path is given, the page images are low-DPI
+    renders (detect_dpi) and the segments are cropped from a crop_dpi render of
+    the region they cover (see _save_segments).
+    pages restricts the run to these page numbers. With inference_url, detection
+    is done by the local inference server, one request per batch of pages.
+    segment_filter: see _save_segments.
+    layout_templates (config "layout_templates" section): pages whose stored
+    template for this journal and page number still fits reuse its boxes and
+    skip YOLO; the other pages update the template.
+    model: an already loaded YOLO instance (e.g. kept by a queue worker across
+    page tasks); model_path is then not loaded again.
+    """
     image_dir = Path(image_dir)
     output_segment_dir = ensure_dir(image_dir / "segment")
 
-    if not Path(model_path).exists():
-        logger.error(f"YOLO model not found: {model_path}")
-        return
-
-    model = YOLO(model_path)
-    image_files = [f for f in image_dir.glob("*.png")]
+    if inference_url:
+        model = None
+    elif model is None:
+        if not Path(model_path).exists():
+            logger.error(f"YOLO model not found: {model_path}")
+            return
+        model = YOLO(model_path)
+    image_files = _page_images(image_dir, pages)
     if not image_files:
         logger.error(f"No PNG images found in {image_dir}")
         return
 
+    templates = _open_templates(layout_templates)
+    journal = image_dir.parent.name  # output/nom_journal/date
     logger.info(f"Processing {len(image_files)} images")
+    records = []
+    from_templates = 0
     for i in range(0, len(image_files), batch_size):
         batch = image_files[i:i + batch_size]
-        for file in batch:
-            image = cv2.imread(str(file))
+        images = [cv2.imread(str(file)) for file in batch]
+        matched = [_match_template(templates, journal, file.stem, image) for file, image in zip(batch, images)]
+        from_templates += sum(m is not None for m in matched)
+        # Only pages without a fitting template go to YOLO
+        pending = [j for j, (image, m) in enumerate(zip(images, matched)) if image is not None and m is None]
+        remote = detect_remote(inference_url, [batch[j] for j in pending]) if inference_url and pending else None
+        for j, (file, image) in enumerate(zip(batch, images)):
             if image is None:
                 logger.error(f"Failed to load image: {file}")
                 continue
 
-            results = model(image)
-            if not results or not results[0].boxes:
+            detected = matched[j]
+            if detected is None:
+                detected = remote[pending.index(j)] if remote is not None else _detect(model, image)
+                if detected is not None and templates is not None:
+                    templates.store(journal, _page_number(file.stem), image, *detected)
+            if detected is None:
                 logger.warning(f"No detections for {file}")
                 continue
 
-            boxes = results[0].boxes.xyxy.cpu().numpy().astype(int)
-            classes = results[0].boxes.cls.cpu().numpy().astype(int)
+            boxes, classes = detected
+            records += _save_segments(image, boxes, classes, file.stem, output_segment_dir,
+                                      pdf_path, detect_dpi, crop_dpi, segment_filter)
+
+    if templates is not None:
+        templates.close()
+        logger.info(f"Layout templates: {from_templates}/{len(image_files)} pages segmented without YOLO")
+    _write_catalog(image_dir, records, {_page_number(f.stem) for f in image_files})
+    logger.info(f"Segmentation completed: {output_segment_dir}")
+
+
+# === Mode multi-processus ===
+# Each worker process owns its own YOLO instance with a fixed torch thread
+# count. Pages are decoded once in the parent and placed in a shared memory
+# block; workers attach to it and read their pages as zero-copy numpy views,
+# so only (name, offset, shape) tuples are pickled.
+
+_worker_model = None
+
+
+def _init_worker(model_path: str, torch_threads: int):
+    global _worker_model
+    import torch
+    torch.set_num_threads(torch_threads)
+    _worker_model = YOLO(model_path)
+
+
+def _segment_shard(shm_name: str, pages: list, output_segment_dir: Path, hires: tuple = (None, None, None),
+                   segment_filter: dict = None, layout_templates: dict = None) -> list:
+    """Segment the pages of one shard. pages: list of (stem, offset, shape). Returns the SegmentRecords."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    templates = _open_templates(layout_templates)
+    journal = output_segment_dir.parent.parent.name  # output/nom_journal/date/segment
+    records = []
+    try:
+        for stem, offset, shape in pages:
+            image = np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+            detected = _match_template(templates, journal, stem, image)
+            if detected is None:
+                detected = _detect(_worker_model, image)
+                if detected is not None and templates is not None:
+                    templates.store(journal, _page_number(stem), image, *detected)
+            if detected is None:
+                logger.warning(f"No detections for {stem}")
+            else:
+                boxes, classes = detected
+                records += _save_segments(image, boxes, classes, stem, output_segment_dir, *hires, segment_filter)
+            del image
+    finally:
+        shm.close()
+        if templates is not None:
+            templates.close()
+    return records
+
+
+def segment_articles_with_yolo_parallel(image_dir: str, model_path: str, num_workers: int = None,
+                                        torch_threads: int = 1, batch_size: int = 10,
+                                        pdf_path: str = None, detect_dpi: int = None, crop_dpi: int = None,
+                                        pages: set = None, segment_filter: dict = None,
+                                        layout_templates: dict = None):
+    """Same output as segment_articles_with_yolo, with pages sharded over num_workers processes.
+
+    Pages are loaded in windows of num_workers * batch_size pages to bound the
+    size of the shared memory block. Within a window, page i goes to shard
+    i % num_workers. Segment file names only depend on the page and the box
+    index, so the output is identical to the single-process mode.
+    pdf_path / detect_dpi / crop_dpi / pages / segment_filter / layout_templates:
+    see segment_articles_with_yolo.
+    """
+    image_dir = Path(image_dir)
+    output_segment_dir = ensure_dir(image_dir / "segment")
+
+    if not Path(model_path).exists():
+        logger.error(f"YOLO model not found: {model_path}")
+        return
+
+    image_files = _page_images(image_dir, pages)
+    if not image_files:
+        logger.error(f"No PNG images found in {image_dir}")
+        return
+
+    num_workers = max(1, num_workers or mp.cpu_count())
+    window = num_workers * batch_size
+    logger.info(f"Processing {len(image_files)} images with {num_workers} workers "
+                f"({torch_threads} torch threads each)")
+
+    records = []
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=mp.get_context("spawn"),
+                             initializer=_init_worker, initargs=(str(model_path), torch_threads)) as executor:
+        for i in range(0, len(image_files), window):
+            images = []
+            for file in image_files[i:i + window]:
+                image = cv2.imread(str(file))
+                if image is None:
+                    logger.error(f"Failed to load image: {file}")
+                    continue
+                images.append((file.stem, image))
+            if not images:
+                continue
+
+            shm = shared_memory.SharedMemory(create=True, size=sum(img.nbytes for _, img in images))
+            try:
+                shards = [[] for _ in range(num_workers)]
+                offset = 0
+                for page_idx, (stem, image) in enumerate(images):
+                    view = np.ndarray(image.shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+                    view[:] = image
+                    del view
+                    shards[page_idx % num_workers].append((stem, offset, image.shape))
+                    offset += image.nbytes
+                del images
 
-            for idx, ((x1, y1, x2, y2), cls) in enumerate(zip(boxes, classes)):
-                segment = image[y1:y2, x1:x2]
-                class_label = f"article_{cls:02d}"
-                segment_filename = f"{file.stem}_{class_label}_{idx+1}.png"
-                segment_path = output_segment_dir / segment_filename
-                cv2.imwrite(str(segment_path), segment)
-                logger.info(f"Saved segment: {segment_filename}")
+                futures = [executor.submit(_segment_shard, shm.name, shard, output_segment_dir,
+                                           (pdf_path, detect_dpi, crop_dpi), segment_filter, layout_templates)
+                           for shard in shards if shard]
+                for future in futures:
+                    records += future.result()
+            finally:
+                shm.close()
+                shm.unlink()
 
-    logger.info(f"Segmentation completed: {output_segment_dir}")
\ No newline at end of file
+    _write_catalog(image_dir, records, {_page_number(f.stem) for f in image_files})
+    logger.info(f"Segmentation completed: {output_segment_dir}")
@@ -0,0 +1,199 @@
+import json
+import sqlite3
+import threading
+import time
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from utils import file_lock
+
+logger = logging.getLogger(__name__)
+
+# Cache des segments déjà traités (mastheads, publicités récurrentes, avis
+# répétés...), indexé par hash perceptuel (pHash 64 bits). Un nouveau segment
+# à distance de Hamming <= max_distance d'un segment connu reprend son texte
+# OCR et sa classification au lieu d'appeler Vision.
+#
+# Recherche : le hash est découpé en 4 bandes de 16 bits indexées. Deux hashs
+# à distance <= 3 ont forcément une bande identique (principe des tiroirs),
+# donc la recherche est exacte jusqu'à 3 ; au-delà, des correspondances
+# peuvent être manquées.
+#
+# Confirmation : le pHash (vignette 32x32) ne distingue pas deux avis
+# différents de même taille et de même disposition de paragraphes, très
+# fréquents dans les pages d'annonces. Un candidat n'est donc réutilisé que si
+# ses dimensions sont quasi identiques (max_size_diff) et si sa vignette
+# binarisée 128x128 diffère de celle du segment sur au plus max_thumb_diff des
+# pixels (des mots différents y changent des centaines de pixels). Compromis :
+# un même segment re-rendu à une autre résolution ou légèrement recadré n'est
+# plus reconnu et repasse par Vision ; c'est voulu, une réutilisation à tort
+# recopierait le texte, is_legal et la catégorie d'un autre avis.
+NUM_BANDS = 4
+BAND_BITS = 16
+THUMB_SIZE = 128
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    id INTEGER PRIMARY KEY,
+    hash INTEGER NOT NULL,
+    b0 INTEGER NOT NULL, b1 INTEGER NOT NULL, b2 INTEGER NOT NULL, b3 INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    thumb BLOB,
+    is_legal INTEGER,
+    cat TEXT,
+    source TEXT,
+    hits INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_segments_b0 ON segments (b0);
+CREATE INDEX IF NOT EXISTS idx_segments_b1 ON segments (b1);
+CREATE INDEX IF NOT EXISTS idx_segments_b2 ON segments (b2);
+CREATE INDEX IF NOT EXISTS idx_segments_b3 ON segments (b3);
+"""
+
+# Correspondance segment → entrée du cache pour une édition, écrite par l'OCR
+# dans ocr_text/ et relue par les classifieurs.
+SEGMENT_IDS_FILE = "segment_cache_ids.json"
+
+
+def phash(image) -> int:
+    """pHash 64 bits : signe des coefficients DCT basse fréquence (8x8) par rapport à leur médiane."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def thumbnail(image) -> bytes:
+    """Vignette THUMB_SIZE x THUMB_SIZE binarisée (Otsu), un bit par pixel."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (THUMB_SIZE, THUMB_SIZE), interpolation=cv2.INTER_AREA)
+    _, binary = cv2.threshold(small, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    return np.packbits(binary.astype(bool)).tobytes()
+
+
+def thumb_diff(a: bytes, b: bytes) -> float:
+    """Part des pixels qui diffèrent entre deux vignettes."""
+    xor = np.frombuffer(a, dtype=np.uint8) ^ np.frombuffer(b, dtype=np.uint8)
+    return int(np.unpackbits(xor).sum()) / (THUMB_SIZE * THUMB_SIZE)
+
+
+def _bands(h: int) -> list:
+    return [(h >> (BAND_BITS * i)) & ((1 << BAND_BITS) - 1) for i in range(NUM_BANDS)]
+
+
+def _to_signed(h: int) -> int:
+    # SQLite INTEGER est signé sur 64 bits
+    return h - (1 << 64) if h >= (1 << 63) else h
+
+
+class SegmentCache:
+    """Index SQLite des segments déjà OCRisés, partagé entre les éditions."""
+
+    def __init__(self, db_path, max_distance: int = 3, max_size_diff: float = 0.02, max_thumb_diff: float = 0.01):
+        self.max_distance = max_distance
+        self.max_size_diff = max_size_diff
+        self.max_thumb_diff = max_thumb_diff
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # L'OCR tourne dans un ThreadPoolExecutor : connexion partagée protégée par un verrou
+        self.conn = sqlite3.connect(str(db_path), timeout=60, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+        # Caches créés avant la confirmation par vignette : leurs entrées (thumb NULL) ne sont plus réutilisées
+        columns = {row["name"] for row in self.conn.execute("PRAGMA table_info(segments)")}
+        if "thumb" not in columns:
+            self.conn.execute("ALTER TABLE segments ADD COLUMN thumb BLOB")
+        self.lock = threading.Lock()
+
+    def close(self):
+        self.conn.close()
+
+    def lookup(self, h: int, width: int, height: int, thumb: bytes):
+        """Entrée confirmée la plus proche (pHash <= max_distance, même taille, même vignette), ou None."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM segments WHERE b0 = ? OR b1 = ? OR b2 = ? OR b3 = ?", _bands(h)).fetchall()
+        candidates = []
+        for row in rows:
+            distance = bin((row["hash"] & ((1 << 64) - 1)) ^ h).count("1")
+            if (distance <= self.max_distance and row["thumb"] is not None
+                    and abs(row["width"] - width) <= self.max_size_diff * width
+                    and abs(row["height"] - height) <= self.max_size_diff * height):
+                candidates.append((distance, row))
+        best = None
+        for distance, row in sorted(candidates, key=lambda c: c[0]):
+            if thumb_diff(row["thumb"], thumb) <= self.max_thumb_diff:
+                best = row
+                break
+        if best is not None:
+            with self.lock:
+                self.conn.execute("UPDATE segments SET hits = hits + 1 WHERE id = ?", (best["id"],))
+        return best
+
+    def add(self, h: int, width: int, height: int, text: str, thumb: bytes, source: str = None) -> int:
+        with self.lock:
+            cur = self.conn.execute(
+                """INSERT INTO segments (hash, b0, b1, b2, b3, width, height, text, thumb, source, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                (_to_signed(h), *_bands(h), width, height, text, thumb, source, time.time()))
+            return cur.lastrowid
+
+    def get(self, entry_id: int):
+        with self.lock:
+            return self.conn.execute("SELECT * FROM segments WHERE id = ?", (entry_id,)).fetchone()
+
+    def set_labels(self, entry_id: int, **labels):
+        """Enregistre is_legal et/ou cat (liste de catégories) pour une entrée."""
+        if "cat" in labels:
+            labels["cat"] = json.dumps(labels["cat"], ensure_ascii=False)
+        if "is_legal" in labels:
+            labels["is_legal"] = int(bool(labels["is_legal"]))
+        sets = ", ".join(f"{k} = ?" for k in labels)
+        with self.lock:
+            self.conn.execute(f"UPDATE segments SET {sets} WHERE id = ?", (*labels.values(), entry_id))
+
+
+def write_segment_ids(ocr_dir: Path, entries: dict):
+    """Fusionne {segment_stem: {"id": ..., "reused": bool}} dans ocr_text/segment_cache_ids.json."""
+    path = Path(ocr_dir) / SEGMENT_IDS_FILE
+    with file_lock(path):
+        current = read_segment_ids(ocr_dir)
+        current.update(entries)
+        path.write_text(json.dumps(current, ensure_ascii=False), encoding="utf-8")
+
+
+def read_segment_ids(ocr_dir: Path) -> dict:
+    path = Path(ocr_dir) / SEGMENT_IDS_FILE
+    return json.loads(path.read_text(encoding="utf-8")) if path.exists() else {}
+
+
+def cached_labels(cache_path, ocr_dir: Path, field: str) -> dict:
+    """{segment_stem: valeur de `field` (is_legal ou cat)} pour les segments réutilisés déjà étiquetés."""
+    cache = SegmentCache(cache_path)
+    labels = {}
+    for stem, entry in read_segment_ids(ocr_dir).items():
+        if not entry["reused"]:
+            continue
+        row = cache.get(entry["id"])
+        if row is None or row[field] is None:
+            continue
+        labels[stem] = bool(row["is_legal"]) if field == "is_legal" else json.loads(row["cat"])
+    cache.close()
+    return labels
+
+
+def record_labels(cache_path, ocr_dir: Path, articles, field: str):
+    """Enregistre `field` des articles classifiés sur les entrées du cache de leurs segments."""
+    cache = SegmentCache(cache_path)
+    segment_ids = read_segment_ids(ocr_dir)
+    for article in articles:
+        entry = segment_ids.get(Path(article["file"]).stem)
+        if entry and field in article:
+            cache.set_labels(entry["id"], **{field: article[field]})
+    cache.close()
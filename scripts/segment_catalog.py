@@ -0,0 +1,158 @@
+import json
+import re
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+from utils import file_lock
+
+# Catalogue des segments d'une édition, construit par la segmentation puis mis
+# à jour par les étapes suivantes (OCR, détection des incomplets, association).
+# Il remplace les parcours répétés de segment/ et ocr_text/ et l'analyse des
+# noms de fichiers (page, classe, index) par des recherches en mémoire.
+# Persisté en un seul fichier JSON en colonnes : segment/catalog.json.
+CATALOG_FILE = "catalog.json"
+
+# Statuts successifs d'un segment
+SEGMENTED = "segmented"      # image découpée, pas encore de texte
+OCR_DONE = "ocr"             # texte disponible (OCR, couche texte PDF ou cache)
+NO_TEXT = "no_text"          # OCR sans résultat
+COMPLETE = "complete"        # article_00 avec référence
+INCOMPLETE = "incomplete"    # article_00 sans référence, à associer
+MATCHED = "matched"          # incomplet associé à un article_01
+
+SEGMENT_NAME_RE = re.compile(r'_page_(\d+)_article_(\d+)_(\d+)$')
+
+
+class SegmentRecord:
+    __slots__ = ("name", "page", "cls", "index", "x1", "y1", "x2", "y2",
+                 "page_width", "page_height", "text_path", "reference", "status")
+
+    def __init__(self, name: str, page: int, cls: int, index: int, x1: int = 0, y1: int = 0, x2: int = 0,
+                 y2: int = 0, page_width: int = 0, page_height: int = 0, text_path: str = None,
+                 reference: str = None, status: str = SEGMENTED):
+        self.name = name
+        self.page = page
+        self.cls = cls
+        self.index = index
+        self.x1, self.y1, self.x2, self.y2 = x1, y1, x2, y2
+        self.page_width = page_width
+        self.page_height = page_height
+        self.text_path = text_path      # relatif au dossier de l'édition, ex. "ocr_text/<name>.txt"
+        self.reference = reference
+        self.status = status
+
+    @property
+    def box(self) -> tuple:
+        return self.x1, self.y1, self.x2, self.y2
+
+    def __repr__(self):
+        return f"SegmentRecord({self.name!r}, page={self.page}, cls={self.cls}, status={self.status!r})"
+
+
+FIELDS = list(SegmentRecord.__slots__)
+
+
+class SegmentCatalog:
+    """Ensemble des SegmentRecord d'une édition, indexés par nom, page et classe."""
+
+    def __init__(self, records=()):
+        self._records = {}
+        for record in records:
+            self._records[record.name] = record
+        self._reindex()
+
+    def _reindex(self):
+        self._by_page = defaultdict(list)
+        self._by_class = defaultdict(list)
+        for record in sorted(self._records.values(), key=lambda r: (r.page, r.index)):
+            self._by_page[record.page].append(record)
+            self._by_class[record.cls].append(record)
+
+    def __iter__(self):
+        return iter(sorted(self._records.values(), key=lambda r: (r.page, r.index)))
+
+    def __len__(self):
+        return len(self._records)
+
+    def get(self, name: str):
+        return self._records.get(name)
+
+    def by_page(self, page: int) -> list:
+        return list(self._by_page.get(page, []))
+
+    def by_class(self, cls: int) -> list:
+        return list(self._by_class.get(cls, []))
+
+    def with_text(self, cls: int = None) -> list:
+        records = self.by_class(cls) if cls is not None else list(self)
+        return [r for r in records if r.text_path]
+
+    def with_status(self, status: str, cls: int = None) -> list:
+        records = self.by_class(cls) if cls is not None else list(self)
+        return [r for r in records if r.status == status]
+
+    def replace_pages(self, pages: set, records: list):
+        """Remplace les segments des pages données (re-segmentation d'une page)."""
+        self._records = {n: r for n, r in self._records.items() if r.page not in pages}
+        for record in records:
+            self._records[record.name] = record
+        self._reindex()
+
+    def update(self, name: str, **fields):
+        record = self._records.get(name)
+        if record is not None:
+            for field, value in fields.items():
+                setattr(record, field, value)
+
+    # === Persistance ===
+
+    def save(self, output_dir: Path):
+        path = catalog_path(output_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        data = {"fields": FIELDS, "rows": [[getattr(r, f) for f in FIELDS] for r in self]}
+        tmp_path = path.with_suffix(".tmp")
+        tmp_path.write_text(json.dumps(data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, output_dir: Path) -> "SegmentCatalog":
+        """Charge segment/catalog.json, ou le reconstruit depuis les fichiers d'une sortie plus ancienne."""
+        path = catalog_path(output_dir)
+        if not path.exists():
+            return cls.from_directory(output_dir)
+        data = json.loads(path.read_text(encoding="utf-8"))
+        fields = data["fields"]
+        return cls(SegmentRecord(**dict(zip(fields, row))) for row in data["rows"])
+
+    @classmethod
+    def from_directory(cls, output_dir: Path) -> "SegmentCatalog":
+        """Reconstruit le catalogue depuis les noms de fichiers (sans géométrie des boîtes)."""
+        output_dir = Path(output_dir)
+        incomplets = {p.stem for p in (output_dir / "incomplets").glob("*.txt")}
+        records = []
+        for png in (output_dir / "segment").glob("*.png"):
+            m = SEGMENT_NAME_RE.search(png.stem)
+            if not m:
+                continue
+            record = SegmentRecord(png.stem, int(m.group(1)), int(m.group(2)), int(m.group(3)))
+            if (output_dir / "ocr_text" / f"{png.stem}.txt").exists():
+                record.text_path = f"ocr_text/{png.stem}.txt"
+                record.status = INCOMPLETE if png.stem in incomplets else OCR_DONE
+            records.append(record)
+        return cls(records)
+
+    @classmethod
+    @contextmanager
+    def edit(cls, output_dir: Path):
+        """Charge, modifie puis enregistre le catalogue sous verrou (workers concurrents)."""
+        path = catalog_path(output_dir)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with file_lock(path):
+            catalog = cls.load(output_dir)
+            yield catalog
+            catalog.save(output_dir)
+
+
+def catalog_path(output_dir: Path) -> Path:
+    return Path(output_dir) / "segment" / CATALOG_FILE
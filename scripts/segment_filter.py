@@ -0,0 +1,105 @@
+import csv
+import logging
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from utils import ensure_dir, file_lock
+
+logger = logging.getLogger(__name__)
+
+# Filtre rapide avant OCR : écarte les segments YOLO qui ne contiennent pas de
+# texte (photos, logos, zones presque vides) à partir de statistiques
+# d'image calculées en quelques millisecondes, sans appel à Vision.
+DEFAULT_THRESHOLDS = {
+    "min_ink": 0.01,              # part de pixels d'encre en dessous de laquelle le segment est vide
+    "max_ink": 0.45,              # au-dessus : aplat, photo
+    "min_edge_density": 0.02,     # part de pixels de contour (texte = nombreux contours fins)
+    "max_component_ratio": 0.5,   # part de l'encre dans la plus grande composante connexe (photo, logo),
+                                  # hors cadres et composantes touchant le bord du segment
+    "min_components": 10,         # nombre minimal de composantes connexes (glyphes)
+    "min_text_lines": 2,          # nombre minimal de lignes dans le profil de projection horizontal
+}
+MAX_SIDE = 1000  # les segments sont réduits à cette taille avant analyse
+REJECTED_DIR = "segment_rejected"
+
+
+def segment_features(crop) -> dict:
+    """Statistiques d'encre, de contours, de composantes connexes et de profil de lignes d'un segment."""
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY) if crop.ndim == 3 else crop
+    scale = MAX_SIDE / max(gray.shape)
+    if scale < 1:
+        gray = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    # Encre : binarisation d'Otsu (texte sombre sur fond clair)
+    _, binary = cv2.threshold(gray, 0, 1, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    ink_pixels = int(binary.sum())
+    ink = ink_pixels / binary.size
+
+    # Contours : gradients horizontaux et verticaux
+    g = gray.astype(np.int16)
+    edges = (np.abs(np.diff(g, axis=1))[:-1, :] > 40) | (np.abs(np.diff(g, axis=0))[:, :-1] > 40)
+    edge_density = float(edges.mean()) if edges.size else 0.0
+
+    # Composantes connexes. Les cadres des avis encadrés et les débords des
+    # segments voisins (composantes touchant le bord du segment ou couvrant
+    # presque toute sa surface) sont exclus : sinon un avis encadré passerait
+    # pour une photo.
+    n, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    stats = stats[1:]
+    stats = stats[stats[:, cv2.CC_STAT_AREA] >= 3]  # bruit
+    h, w = binary.shape
+    x, y = stats[:, cv2.CC_STAT_LEFT], stats[:, cv2.CC_STAT_TOP]
+    cw, ch = stats[:, cv2.CC_STAT_WIDTH], stats[:, cv2.CC_STAT_HEIGHT]
+    border = (x == 0) | (y == 0) | (x + cw >= w) | (y + ch >= h)
+    frame = (cw >= 0.9 * w) & (ch >= 0.9 * h)
+    areas = stats[~(border | frame), cv2.CC_STAT_AREA]
+    components = int(areas.size)
+    component_ratio = float(areas.max()) / max(int(areas.sum()), 1) if components else 0.0
+
+    # Profil de projection horizontal : lignes de texte = suites de rangées encrées séparées par des blancs
+    row_ink = binary.mean(axis=1) > 0.02
+    text_lines = int(np.count_nonzero(row_ink[1:] & ~row_ink[:-1]) + (1 if row_ink.size and row_ink[0] else 0))
+
+    return {
+        "ink": round(ink, 4),
+        "edge_density": round(edge_density, 4),
+        "components": components,
+        "component_ratio": round(component_ratio, 4),
+        "text_lines": text_lines,
+    }
+
+
+def classify_segment(crop, thresholds: dict = None):
+    """Retourne (is_text, raison, features). raison est vide pour un segment texte."""
+    t = {**DEFAULT_THRESHOLDS, **(thresholds or {})}
+    f = segment_features(crop)
+    if f["ink"] < t["min_ink"]:
+        return False, "empty", f
+    if f["ink"] > t["max_ink"]:
+        return False, "too_dense", f
+    if f["edge_density"] < t["min_edge_density"]:
+        return False, "few_edges", f
+    if f["component_ratio"] > t["max_component_ratio"]:
+        return False, "large_blob", f
+    if f["components"] < t["min_components"]:
+        return False, "few_components", f
+    if f["text_lines"] < t["min_text_lines"]:
+        return False, "no_text_lines", f
+    return True, "", f
+
+
+def dump_rejected(image_dir: Path, segment_name: str, crop, reason: str, features: dict):
+    """Mode debug : copie le segment écarté dans segment_rejected/ et journalise ses statistiques."""
+    rejected_dir = ensure_dir(Path(image_dir) / REJECTED_DIR)
+    cv2.imwrite(str(rejected_dir / f"{segment_name}.png"), crop)
+    report = rejected_dir / "rejected.csv"
+    fields = ["segment", "reason"] + list(features)
+    with file_lock(report):
+        new_file = not report.exists()
+        with report.open("a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fields)
+            if new_file:
+                writer.writeheader()
+            writer.writerow({"segment": segment_name, "reason": reason, **features})
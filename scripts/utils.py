@@ -1,6 +1,9 @@
 # src/utils.py
 from pathlib import Path
+from contextlib import contextmanager
 import logging
+import os
+import time
 
 logger = logging.getLogger(__name__)
 
@@ -8,4 +11,37 @@ def ensure_dir(path: Path) -> Path:
     """Create directory if it doesn't exist."""
     path.mkdir(parents=True, exist_ok=True)
     logger.info(f"Directory ensured: {path}")
-    return path
\ No newline at end of file
+    return path
+
+
+@contextmanager
+def file_lock(path: Path, timeout: float = 60, stale_after: float = 300):
+    """Exclusive lock on `path` via an O_EXCL lock file (works on shared/network storage).
+
+    A lock file older than stale_after seconds is considered left over by a
+    crashed process and is removed.
+    """
+    lock_path = Path(str(path) + ".lock")
+    deadline = time.time() + timeout
+    while True:
+        try:
+            fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            break
+        except FileExistsError:
+            try:
+                if time.time() - lock_path.stat().st_mtime > stale_after:
+                    lock_path.unlink()
+                    continue
+            except FileNotFoundError:
+                continue
+            if time.time() > deadline:
+                raise TimeoutError(f"Lock timeout: {lock_path}")
+            time.sleep(0.1)
+    try:
+        yield
+    finally:
+        os.close(fd)
+        try:
+            lock_path.unlink()
+        except FileNotFoundError:
+            pass
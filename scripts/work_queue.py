@@ -0,0 +1,200 @@
+import sqlite3
+import time
+import logging
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Étapes exécutées page par page, dans cet ordre. Quand la dernière étape est
+# terminée pour toutes les pages d'une édition, une tâche "finalize" (détection
+# des incomplets, association, export, classification) est créée pour l'édition.
+PAGE_STAGES = ["rasterize", "segment", "ocr"]
+FINALIZE = "finalize"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS editions (
+    id INTEGER PRIMARY KEY,
+    pdf_path TEXT NOT NULL,
+    nom_journal TEXT NOT NULL,
+    output_dir TEXT NOT NULL UNIQUE,
+    num_pages INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tasks (
+    id INTEGER PRIMARY KEY,
+    edition_id INTEGER NOT NULL REFERENCES editions(id),
+    stage TEXT NOT NULL,
+    page INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    not_before REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    error TEXT,
+    updated_at REAL,
+    UNIQUE (edition_id, stage, page)
+);
+CREATE INDEX IF NOT EXISTS idx_tasks_claim ON tasks (status, not_before);
+"""
+
+
+class WorkQueue:
+    """File de tâches durable (SQLite) partagée par plusieurs workers.
+
+    Les tâches sont réclamées avec un bail (lease) : un worker qui meurt sans
+    terminer sa tâche la rend disponible à l'expiration du bail. Une tâche en
+    échec est relancée (avec délai croissant) jusqu'à max_attempts tentatives.
+    Les artefacts (images, segments, textes OCR) transitent par le dossier
+    output_dir de l'édition, sur le stockage partagé.
+    """
+
+    def __init__(self, db_path, lease_seconds: int = 900, max_attempts: int = 3, retry_delay: int = 30):
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # Pas de WAL : non supporté sur les systèmes de fichiers réseau
+        self.conn = sqlite3.connect(str(db_path), timeout=60, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _transaction(self):
+        # BEGIN IMMEDIATE : verrou d'écriture dès le début, deux workers ne peuvent pas réclamer la même tâche
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+
+    def add_edition(self, pdf_path: str, nom_journal: str, output_dir: str, num_pages: int):
+        """Enregistre une édition et crée une tâche de rastérisation par page.
+
+        Retourne None si une édition avec le même dossier de sortie est déjà dans la file.
+        """
+        now = time.time()
+        try:
+            with self._transaction():
+                cur = self.conn.execute(
+                    "INSERT INTO editions (pdf_path, nom_journal, output_dir, num_pages, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (str(pdf_path), nom_journal, str(output_dir), num_pages, now))
+                edition_id = cur.lastrowid
+                self.conn.executemany(
+                    "INSERT INTO tasks (edition_id, stage, page, updated_at) VALUES (?, ?, ?, ?)",
+                    [(edition_id, PAGE_STAGES[0], page, now) for page in range(1, num_pages + 1)])
+        except sqlite3.IntegrityError:
+            logger.error(f"Édition déjà dans la file pour {output_dir} (édition {self.find_edition(output_dir)})")
+            return None
+        logger.info(f"Édition {edition_id} ajoutée : {pdf_path} ({num_pages} pages)")
+        return edition_id
+
+    def find_edition(self, output_dir: str):
+        """Identifiant de l'édition écrivant dans output_dir, ou None."""
+        row = self.conn.execute("SELECT id FROM editions WHERE output_dir = ?", (str(output_dir),)).fetchone()
+        return row["id"] if row else None
+
+    def claim(self, worker_id: str):
+        """Réclame la prochaine tâche disponible, ou None.
+
+        Les tâches 'finalize' passent en premier pour terminer les éditions au plus tôt.
+        """
+        now = time.time()
+        with self._transaction():
+            # Baux expirés ayant épuisé leurs tentatives → échec définitif
+            expired = self.conn.execute(
+                "SELECT id, edition_id FROM tasks WHERE status = 'running' AND lease_expires < ? AND attempts >= ?",
+                (now, self.max_attempts)).fetchall()
+            for row in expired:
+                self._mark_failed(row["id"], row["edition_id"], "lease expired", now)
+
+            row = self.conn.execute(
+                """SELECT t.*, e.pdf_path, e.nom_journal, e.output_dir, e.num_pages
+                   FROM tasks t JOIN editions e ON e.id = t.edition_id
+                   WHERE (t.status = 'pending' AND t.not_before <= ?)
+                      OR (t.status = 'running' AND t.lease_expires < ?)
+                   ORDER BY (t.stage = ?) DESC, t.id
+                   LIMIT 1""",
+                (now, now, FINALIZE)).fetchone()
+            if row is None:
+                return None
+            self.conn.execute(
+                """UPDATE tasks SET status = 'running', lease_owner = ?, lease_expires = ?,
+                   attempts = attempts + 1, updated_at = ? WHERE id = ?""",
+                (worker_id, now + self.lease_seconds, now, row["id"]))
+            self.conn.execute("UPDATE editions SET status = 'running' WHERE id = ? AND status = 'pending'",
+                              (row["edition_id"],))
+        task = dict(row)
+        task["attempts"] += 1
+        return task
+
+    def renew(self, task_id: int, worker_id: str) -> bool:
+        """Prolonge le bail d'une tâche en cours. False si le bail a été perdu."""
+        cur = self.conn.execute(
+            "UPDATE tasks SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'running'",
+            (time.time() + self.lease_seconds, task_id, worker_id))
+        return cur.rowcount == 1
+
+    def complete(self, task_id: int, worker_id: str):
+        """Marque la tâche terminée et crée la tâche suivante (étape suivante ou finalize)."""
+        now = time.time()
+        with self._transaction():
+            task = self.conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if task is None or task["lease_owner"] != worker_id or task["status"] != "running":
+                logger.warning(f"Tâche {task_id} : bail perdu, résultat ignoré")
+                return
+            self.conn.execute("UPDATE tasks SET status = 'done', error = NULL, updated_at = ? WHERE id = ?",
+                              (now, task_id))
+            edition_id = task["edition_id"]
+
+            if task["stage"] == FINALIZE:
+                self.conn.execute("UPDATE editions SET status = 'done' WHERE id = ?", (edition_id,))
+                return
+
+            stage_idx = PAGE_STAGES.index(task["stage"])
+            if stage_idx + 1 < len(PAGE_STAGES):
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO tasks (edition_id, stage, page, updated_at) VALUES (?, ?, ?, ?)",
+                    (edition_id, PAGE_STAGES[stage_idx + 1], task["page"], now))
+                return
+
+            # Jointure : toutes les pages ont terminé la dernière étape
+            done, num_pages = self.conn.execute(
+                """SELECT COUNT(*), e.num_pages FROM tasks t JOIN editions e ON e.id = t.edition_id
+                   WHERE t.edition_id = ? AND t.stage = ? AND t.status = 'done'""",
+                (edition_id, PAGE_STAGES[-1])).fetchone()
+            if done == num_pages:
+                self.conn.execute(
+                    "INSERT OR IGNORE INTO tasks (edition_id, stage, page, updated_at) VALUES (?, ?, 0, ?)",
+                    (edition_id, FINALIZE, now))
+
+    def fail(self, task_id: int, worker_id: str, error: str):
+        """Remet la tâche en attente avec un délai, ou l'abandonne après max_attempts."""
+        now = time.time()
+        with self._transaction():
+            task = self.conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if task is None or task["lease_owner"] != worker_id or task["status"] != "running":
+                return
+            if task["attempts"] >= self.max_attempts:
+                self._mark_failed(task_id, task["edition_id"], error, now)
+            else:
+                self.conn.execute(
+                    """UPDATE tasks SET status = 'pending', lease_owner = NULL, lease_expires = NULL,
+                       not_before = ?, error = ?, updated_at = ? WHERE id = ?""",
+                    (now + self.retry_delay * 2 ** (task["attempts"] - 1), error, now, task_id))
+
+    def _mark_failed(self, task_id: int, edition_id: int, error: str, now: float):
+        self.conn.execute("UPDATE tasks SET status = 'failed', error = ?, updated_at = ? WHERE id = ?",
+                          (error, now, task_id))
+        self.conn.execute("UPDATE editions SET status = 'failed' WHERE id = ?", (edition_id,))
+        logger.error(f"Tâche {task_id} abandonnée : {error}")
+
+    def edition_status(self, edition_id: int) -> dict:
+        """Nombre de tâches par (étape, statut) pour une édition."""
+        rows = self.conn.execute(
+            "SELECT stage, status, COUNT(*) AS n FROM tasks WHERE edition_id = ? GROUP BY stage, status",
+            (edition_id,)).fetchall()
+        return {(r["stage"], r["status"]): r["n"] for r in rows}